@@ -1,13 +1,17 @@
+import hashlib
 import logging
 import json
-import datetime
 import pathlib
 import os
+import sys
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import plotly.io
-
-import pandas as pd
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'python-code'
+))
+from instrumentation import add_arguments, count, instrumented, timer
 
 
 log = logging.getLogger('Mapbox Plotter')
@@ -29,9 +33,31 @@ def get_parser():
         help='Set the logging level'
     )
     parser.add_argument(
-        '-f', '--format', default='png',
+        '-f', '--format', default=None,
         choices=['png', 'webp', 'svg', 'html'],
-        help='The format to save the plots to'
+        help='The format to save the plots to (default png, html with --animated)'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of processes to render frames with'
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Re-render every frame, even those unchanged since the last run'
+    )
+    parser.add_argument(
+        '--animated', action='store_true',
+        help=(
+            'Write a single HTML figure with a frame per year and a slider '
+            'instead of a file per year'
+        )
+    )
+    parser.add_argument(
+        '--size-report', action='store_true',
+        help=(
+            'With --animated, also render a file per year in memory and '
+            'compare their total size with the animated HTML'
+        )
     )
     parser.add_argument(
         'geojson', type=str,
@@ -57,6 +83,7 @@ def get_parser():
         'outdir', type=str,
         help='Filepath to output the plots to'
     )
+    add_arguments(parser)
     return parser
 
 
@@ -93,16 +120,41 @@ ONE_CENTROID_TEAMS = {
 }
 
 
-def make_label(row):
-    outcomes = {'A': 'W', 'B': 'L'}
-    if pd.isna(row.years_played):
-        return f'<b>{row.statename}</b><br>No international representative team'
-    dt = datetime.datetime.fromtimestamp(row.ko_sec, tz=datetime.timezone.utc)
-    return (
-        f'<b>{row.team_name}</b><br>{dt.strftime("%d %b %Y")}<br>v {row.oppname}'
-        f'<br>{outcomes.get(row.outcome, "D")}'
-        f' {int(row.tm_score)} - {int(row.oppscore)}'
+OUTCOMES = {'A': 'W', 'B': 'L'}
+
+
+def make_labels(df):
+    """Hover labels for every row of `df`, built a column at a time."""
+    import numpy as np
+    import pandas as pd
+
+    played = df.years_played.notna()
+
+    def text(col):
+        return df[col].astype(str).astype(object)
+
+    def score(col):
+        return df[col].where(played, 0).astype(int).astype(str).astype(object)
+
+    # Many rows share a kick-off day, so only format each day once
+    day_codes, days = pd.factorize(df.ko_sec.where(played) // 86400)
+    day_text = np.append(
+        pd.to_datetime(days, unit='D').strftime('%d %b %Y').to_numpy(object),
+        ''
+    )
+    kickoff = pd.Series(day_text[day_codes], index=df.index)
+
+    no_team = (
+        '<b>' + text('statename')
+        + '</b><br>No international representative team'
+    )
+    team = (
+        '<b>' + text('team_name') + '</b><br>' + kickoff
+        + '<br>v ' + text('oppname')
+        + '<br>' + df.outcome.map(OUTCOMES).fillna('D').astype(object)
+        + ' ' + score('tm_score') + ' - ' + score('oppscore')
     )
+    return team.where(played, no_team)
 
 
 def get_centroids(cjson):
@@ -114,19 +166,28 @@ def get_centroids(cjson):
     }
 
 
-def main(args):
-    with open(args.geojson, 'r') as geoj:
-        geojson = json.load(geoj)
-
-    centroids = get_centroids(args.centroids)
-
-    df = pd.read_csv(args.input_data)
+def prepare(df, centroids, years):
+    """
+    Add hover labels and the debut marker position of each debut row to
+    `df`, then split it into a slice per year in `years`.
+    """
+    import pandas as pd
 
-    df['label'] = df.apply(make_label, axis=1)
+    df['label'] = make_labels(df)
+    debut_unit = df.team_name.map(ONE_CENTROID_TEAMS).fillna(df.geounit)
+    df['debut_unit'] = debut_unit.where(df.years_played == 0)
+    lookup = pd.DataFrame(
+        [(unit, lon, lat) for unit, (lon, lat) in centroids.items()],
+        columns=['debut_unit', 'debut_lon', 'debut_lat']
+    )
+    df = df.merge(lookup, on='debut_unit', how='left')
+    groups = dict(tuple(df.groupby('year', sort=False)))
+    empty = df.iloc[:0]
+    return {y: groups.get(y, empty) for y in years}
 
-    years = range(args.min_year, args.max_year+1)
 
-    layout = dict(
+def make_layout():
+    return dict(
         mapbox={
             'style': 'white-bg',
             'zoom': 1.37,
@@ -136,128 +197,387 @@ def main(args):
         coloraxis={'showscale': False}
     )
 
-    outpath = pathlib.Path(args.outdir)
 
-    for i, y in enumerate(years):
-        dfsub = df[df.year == y]
-        maptrace = dict(
-            type='choroplethmapbox',
-            geojson=geojson,
-            locations=dfsub.geounit,
-            z=dfsub.colorscale,
-            zmin=-1,
-            zmax=1,
-            colorscale=colorpal,
-            showscale=False,
-            autocolorscale=False,
-            reversescale=False,
-            hovertext=dfsub.label,
-            hoverinfo='text',
-            below=''
-        )
+def make_figure(y, dfsub, geojson, layout):
+    """Build the figure dict for year `y` from that year's rows `dfsub`."""
+    maptrace = dict(
+        type='choroplethmapbox',
+        geojson=geojson,
+        locations=dfsub.geounit,
+        z=dfsub.colorscale,
+        zmin=-1,
+        zmax=1,
+        colorscale=colorpal,
+        showscale=False,
+        autocolorscale=False,
+        reversescale=False,
+        hovertext=dfsub.label,
+        hoverinfo='text',
+        below=''
+    )
 
-        dfdebs = dfsub[dfsub.years_played == 0]
-        debuts = dfdebs.apply(
-            lambda x: ONE_CENTROID_TEAMS.get(x.team_name, x.geounit),
-            axis=1, result_type='reduce'
-        ).unique()
-
-        longitudes = []
-        latitudes = []
-
-        for d in debuts:
-            lon, lat = centroids[d]
-            longitudes.append(lon)
-            latitudes.append(lat)
-
-        centroid_trace = dict(
-            type='scattermapbox',
-            lon=longitudes,
-            lat=latitudes,
-            mode='markers',
-            marker=dict(
-                size=9,
-                color="#FF00A7",
-                showscale=False
-            ),
-            hoverinfo='skip',
-            showlegend=False,
-            below=''
-        )
+    dfdebs = dfsub[dfsub.years_played == 0]
+    markers = dfdebs.drop_duplicates('debut_unit')
+    missing = markers.debut_unit[markers.debut_lon.isna()]
+    if len(missing):
+        raise KeyError(f'No centroid for {", ".join(missing)}')
+
+    longitudes = markers.debut_lon.tolist()
+    latitudes = markers.debut_lat.tolist()
+
+    centroid_trace = dict(
+        type='scattermapbox',
+        lon=longitudes,
+        lat=latitudes,
+        mode='markers',
+        marker=dict(
+            size=9,
+            color="#FF00A7",
+            showscale=False
+        ),
+        hoverinfo='skip',
+        showlegend=False,
+        below=''
+    )
 
-        title = dict(
-            text=f'The Spread of Rugby Union: {y}',
-            font={'size': 30},
-            xref='paper',
-            xanchor='left',
-            x=0
-        )
-        subtitle_text = (
-            "Tracking the first match for each international level men's team"
-            " | Match is not necessarily a test match <br>"
-            "Darker green represents older team"
-            " | Pink dots represent debut nations"
+    title = dict(
+        text=f'The Spread of Rugby Union: {y}',
+        font={'size': 30},
+        xref='paper',
+        xanchor='left',
+        x=0
+    )
+    subtitle_text = (
+        "Tracking the first match for each international level men's team"
+        " | Match is not necessarily a test match <br>"
+        "Darker green represents older team"
+        " | Pink dots represent debut nations"
+    )
+    debutants_text = f'Debuts: {", ".join(dfdebs.team_name.unique())}'
+    credits_text = 'Graph: @awgymer | Data: https://www.world.rugby'
+
+    subtitle = dict(
+        showarrow=False,
+        text=subtitle_text,
+        xref='paper',
+        yref='paper',
+        xanchor='left',
+        yanchor='bottom',
+        x=0, y=1,
+        align='left'
+    )
+    debutants = dict(
+        showarrow=False,
+        text=debutants_text,
+        xref='paper',
+        yref='paper',
+        xanchor='left',
+        yanchor='top',
+        x=0, y=0,
+        align='left',
+        font={'size': 20}
+    )
+    credits = dict(
+        showarrow=False,
+        text=credits_text,
+        xref='paper',
+        yref='paper',
+        xanchor='right',
+        yanchor='top',
+        x=1, y=0,
+    )
+    annotations = [subtitle, debutants, credits]
+    layout = dict(layout, title=title, annotations=annotations)
+    traces = [maptrace, centroid_trace]
+    return dict(data=traces, layout=layout)
+
+
+def write_figure(fig, outfile, fmt):
+    import plotly.io
+
+    if fmt == 'html':
+        plotly.io.write_html(
+            fig, str(outfile), include_plotlyjs='directory'
         )
-        debutants_text = f'Debuts: {", ".join(dfdebs.team_name.unique())}'
-        credits_text = 'Graph: @awgymer | Data: https://www.world.rugby'
-
-        subtitle = dict(
-            showarrow=False,
-            text=subtitle_text,
-            xref='paper',
-            yref='paper',
-            xanchor='left',
-            yanchor='bottom',
-            x=0, y=1,
-            align='left'
+    elif fmt == 'svg':
+        plotly.io.write_image(
+            fig, str(outfile), fmt,
+            width=1600, height=900
         )
-        debutants = dict(
-            showarrow=False,
-            text=debutants_text,
-            xref='paper',
-            yref='paper',
-            xanchor='left',
-            yanchor='top',
-            x=0, y=0,
-            align='left',
-            font={'size': 20}
+    else:
+        plotly.io.write_image(
+            fig, str(outfile), fmt,
+            width=1600, height=900, scale=4
         )
-        credits = dict(
-            showarrow=False,
-            text=credits_text,
-            xref='paper',
-            yref='paper',
-            xanchor='right',
-            yanchor='top',
-            x=1, y=0,
+
+
+# Keys of the map and debut marker traces that change from year to year
+FRAME_KEYS = (
+    ('type', 'locations', 'z', 'hovertext'),
+    ('type', 'lon', 'lat'),
+)
+
+
+def make_animation(slices, geojson, layout):
+    """
+    Build one figure with a frame per year and a year slider.
+
+    Only the base trace carries the GeoJSON and styling; frames update the
+    per-year `locations`, `z`, hover text, debut markers and annotations.
+    """
+    if not slices:
+        raise ValueError('No years to animate, check min_year and max_year')
+    frames = []
+    for y, dfsub in slices.items():
+        fig = make_figure(y, dfsub, geojson, layout)
+        frames.append(dict(
+            name=str(y),
+            data=[
+                {k: trace[k] for k in keys}
+                for trace, keys in zip(fig['data'], FRAME_KEYS)
+            ],
+            traces=[0, 1],
+            layout={k: fig['layout'][k] for k in ('title', 'annotations')}
+        ))
+    y, dfsub = next(iter(slices.items()))
+    first = make_figure(y, dfsub, geojson, layout)
+
+    animate = {
+        'mode': 'immediate',
+        'frame': {'duration': 0, 'redraw': True},
+        'transition': {'duration': 0}
+    }
+    slider = dict(
+        active=0,
+        currentvalue={'prefix': 'Year: '},
+        pad={'t': 40},
+        steps=[
+            dict(label=f['name'], method='animate', args=[[f['name']], animate])
+            for f in frames
+        ]
+    )
+    play = dict(
+        type='buttons',
+        showactive=False,
+        x=0, y=0, xanchor='right', yanchor='top',
+        pad={'t': 40, 'r': 10},
+        buttons=[
+            dict(
+                label='Play', method='animate',
+                args=[None, dict(animate, frame={'duration': 500, 'redraw': True},
+                                 fromcurrent=True)]
+            ),
+            dict(label='Pause', method='animate', args=[[None], animate]),
+        ]
+    )
+    first['layout'] = dict(
+        first['layout'], sliders=[slider], updatemenus=[play]
+    )
+    first['frames'] = frames
+    return first
+
+
+def write_animation(args, slices, layout):
+    import plotly.io
+
+    with open(args.geojson, 'r') as geoj:
+        geojson = json.load(geoj)
+
+    start = time.perf_counter()
+    fig = make_animation(slices, geojson, layout)
+    outfile = pathlib.Path(args.outdir).joinpath('animated_plot.html')
+    plotly.io.write_html(fig, str(outfile), include_plotlyjs='directory')
+    log.info('Saved: %s (%.2fs)', outfile, time.perf_counter() - start)
+    if not args.size_report:
+        return
+
+    animated_bytes = outfile.stat().st_size
+    per_file_bytes = sum(
+        len(plotly.io.to_html(
+            make_figure(y, dfsub, geojson, layout),
+            include_plotlyjs='directory'
+        ).encode('utf-8'))
+        for y, dfsub in slices.items()
+    )
+    print(
+        f'Animated HTML: {animated_bytes:,} bytes for {len(slices)} years | '
+        f'file per year: {per_file_bytes:,} bytes '
+        f'({per_file_bytes / animated_bytes:.1f}x)'
+    )
+
+
+CACHE_FILE = '.render_cache.json'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_key(dfsub, layout, fmt, geojson_digest):
+    """
+    Content hash of everything a frame is rendered from: its rows (which
+    carry the centroids of its debuts), the layout and palette, the output
+    format and the GeoJSON.
+    """
+    digest = hashlib.sha256()
+    digest.update(dfsub.to_csv(index=False).encode('utf-8'))
+    digest.update(json.dumps(
+        [layout, colorpal, fmt, geojson_digest],
+        sort_keys=True
+    ).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_render_cache(outpath):
+    try:
+        with open(outpath.joinpath(CACHE_FILE), 'r') as cache_f:
+            return json.load(cache_f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_render_cache(outpath, cache):
+    tmp = outpath.joinpath(CACHE_FILE + '.tmp')
+    with open(tmp, 'w') as cache_f:
+        json.dump(cache, cache_f, indent=2, sort_keys=True)
+    os.replace(tmp, outpath.joinpath(CACHE_FILE))
+
+
+# Per-process state loaded once by init_worker
+_worker = {}
+
+
+def init_worker(geojson_path):
+    with open(geojson_path, 'r') as geoj:
+        _worker['geojson'] = json.load(geoj)
+
+
+def render_frame(y, dfsub, layout, outfile, fmt):
+    """
+    Render year `y` to `outfile`, returning `(year, outfile, seconds, error)`
+    so one failed frame does not stop the others.
+    """
+    start = time.perf_counter()
+    try:
+        fig = make_figure(y, dfsub, _worker['geojson'], layout)
+        write_figure(fig, outfile, fmt)
+        error = None
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    return y, outfile, time.perf_counter() - start, error
+
+
+def main(args):
+    import pandas as pd
+
+    with timer('read'):
+        df = pd.read_csv(args.input_data)
+
+    years = range(args.min_year, args.max_year+1)
+
+    with timer('prepare'):
+        slices = prepare(df, get_centroids(args.centroids), years)
+
+    layout = make_layout()
+
+    if args.animated:
+        with timer('animation'):
+            write_animation(args, slices, layout)
+        return []
+
+    outpath = pathlib.Path(args.outdir)
+    fmt = args.format or 'png'
+
+    geojson_digest = file_digest(args.geojson)
+    cache = read_render_cache(outpath)
+    new_cache = dict(cache)
+
+    tasks = []
+    keys = {}
+    skipped = []
+    for y, dfsub in slices.items():
+        outfile = outpath.joinpath(f'{y}_plot.{fmt}')
+        key = frame_key(dfsub, layout, fmt, geojson_digest)
+        if (not args.force and cache.get(outfile.name) == key
+                and outfile.exists()):
+            log.debug('Unchanged: %s', outfile)
+            skipped.append(y)
+            continue
+        keys[y] = (outfile.name, key)
+        new_cache.pop(outfile.name, None)
+        tasks.append((y, dfsub, layout, outfile, fmt))
+    count('frames.unchanged', len(skipped))
+    if skipped:
+        log.info(
+            'Skipping %d unchanged frames (use --force to re-render)',
+            len(skipped)
         )
-        annotations = [subtitle, debutants, credits]
-        layout['title'] = title
-        layout['annotations'] = annotations
-        traces = [maptrace, centroid_trace]
-        fig = dict(data=traces, layout=layout)
-
-        outfile = outpath.joinpath(f'{y}_plot.{args.format}')
-        if args.format == 'html':
-            plotly.io.write_html(
-                fig, str(outfile), include_plotlyjs='directory'
-            )
-        elif args.format == 'svg':
-            plotly.io.write_image(
-                fig, str(outfile), args.format,
-                width=1600, height=900
-            )
+
+    start = time.perf_counter()
+    failures = []
+
+    def record(result):
+        y, outfile, seconds, error = result
+        if error is None:
+            log.info('Saved: %s (%.2fs)', outfile, seconds)
+            name, key = keys[y]
+            new_cache[name] = key
+            count('frames.rendered')
         else:
-            plotly.io.write_image(
-                fig, str(outfile), args.format,
-                width=1600, height=900, scale=4
-            )
-        log.info('Saved: %s', outfile)
+            log.error('Failed: %s (%.2fs): %s', outfile, seconds, error)
+            failures.append((y, error))
+            count('frames.failed')
+
+    try:
+        with timer('render'):
+            if args.jobs > 1:
+                with ProcessPoolExecutor(
+                        max_workers=args.jobs, initializer=init_worker,
+                        initargs=(args.geojson,)) as pool:
+                    futures = {pool.submit(render_frame, *t): t for t in tasks}
+                    for fut in as_completed(futures):
+                        try:
+                            result = fut.result()
+                        except Exception as err:
+                            # e.g. BrokenProcessPool if a worker died
+                            y, _, _, outfile, _ = futures[fut]
+                            result = (y, outfile, time.perf_counter() - start,
+                                      f'{type(err).__name__}: {err}')
+                        record(result)
+            elif tasks:
+                init_worker(args.geojson)
+                for t in tasks:
+                    record(render_frame(*t))
+    finally:
+        # Keep the frames rendered so far even if rendering is interrupted
+        write_render_cache(outpath, new_cache)
+    log.info(
+        'Rendered %d of %d frames in %.1fs, %d unchanged',
+        len(tasks) - len(failures), len(tasks), time.perf_counter() - start,
+        len(skipped)
+    )
+    for y, error in sorted(failures):
+        log.error('Year %d failed: %s', y, error)
+    return failures
+
+
+def run(args):
+    if args.animated and args.format not in (None, 'html'):
+        sys.exit(f'--animated writes a single HTML file, not --format {args.format}')
+    log.setLevel(max([50-args.verbosity*10, 10]))
+    print(f'Logging at {logging.getLevelName(log.level)} level')
+    failures = main(args)
+    if failures:
+        print(f'{len(failures)} frames failed: {", ".join(str(y) for y, _ in sorted(failures))}')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
     parser = get_parser()
     args = parser.parse_args()
-    log.setLevel(max([50-args.verbosity*10, 10]))
-    print(f'Logging at {logging.getLevelName(log.level)} level')
-    main(args)
+    with instrumented(args):
+        run(args)
@@ -0,0 +1,797 @@
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+from io import StringIO
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Micro-benchmarks for the rugby data tools')
+    )
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help='Number of timed repeats, the best is reported'
+    )
+    subparsers = parser.add_subparsers(title='program', dest='program')
+
+    parse = subparsers.add_parser(
+        'parse',
+        help='Compare the two-pass and single-pass table parsers'
+    )
+    parse.add_argument(
+        'kind', choices=['espn', 'wiki'],
+        help='Type of page: ESPN engineTable results or Wikipedia squads'
+    )
+    parse.add_argument(
+        'pages', type=str, nargs='+',
+        help='Saved HTML pages to parse'
+    )
+
+    store = subparsers.add_parser(
+        'store',
+        help='Compare MatchStore lookups with the equivalent pandas filters'
+    )
+    store.add_argument(
+        'scorecsv', type=str,
+        help='CSV of test scores'
+    )
+    store.add_argument(
+        '--queries', type=int, default=200,
+        help='Number of random queries of each type'
+    )
+
+    geoids = subparsers.add_parser(
+        'geoids',
+        help='Compare DataFrame scans with the hash index in add_geo_ids'
+    )
+    geoids.add_argument(
+        'geojson', type=str,
+        help='GeoJSON of map units, e.g. Natural Earth 10m admin 0 map units'
+    )
+    geoids.add_argument(
+        'teamcsv', type=str,
+        help='CSV with teams and geo ids'
+    )
+    geoids.add_argument(
+        '-g', '--geocol', type=str, default='geo_id',
+        help='Name of column containing team geoid'
+    )
+
+    plotprep = subparsers.add_parser(
+        'plotprep',
+        help='Compare row-wise and vectorized frame preparation in first_match_plot'
+    )
+    plotprep.add_argument(
+        '--rows', type=int, default=1_000_000,
+        help='Number of rows of synthetic input'
+    )
+
+    enrich = subparsers.add_parser(
+        'enrich',
+        help='Compare row-wise and vectorized squad enrichment'
+    )
+    enrich.add_argument(
+        'squadscsv', type=str,
+        help='Enriched squads CSV, e.g. data/wc_squads_updated.csv'
+    )
+    enrich.add_argument(
+        '--scale', type=int, default=1,
+        help='Number of copies of the squads to enrich'
+    )
+
+    subparsers.add_parser(
+        'startup',
+        help=('Time the start up of each rugby CLI command, and of the script '
+              'behind it, and list the heavy modules each one imports')
+    )
+
+    suite = subparsers.add_parser(
+        'suite',
+        help=('Run the benchmark suite over the fixtures and synthetic data '
+              'and save the results as JSON')
+    )
+    suite.add_argument(
+        '--scales', type=int, nargs='+', default=[1, 10],
+        help='Data scales to run each benchmark at'
+    )
+    suite.add_argument(
+        '-k', '--filter', type=str, default=None,
+        help='Only run benchmarks whose name contains this'
+    )
+    suite.add_argument(
+        '-o', '--out', type=str, default='benchmark_results.json',
+        help='File to write the results JSON to'
+    )
+    suite.add_argument(
+        '--compare', type=str, default=None,
+        help='Results JSON of an earlier run to compare with'
+    )
+    suite.add_argument(
+        '--threshold', type=float, default=0.25,
+        help=('Fractional slowdown against --compare counted as a regression, '
+              'failing the run')
+    )
+    return parser
+
+
+def best_of(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def report(name, before, after, n_items, unit='page'):
+    print(
+        f'{name}: before {1000 * before / n_items:.2f} ms/{unit}, '
+        f'after {1000 * after / n_items:.2f} ms/{unit} '
+        f'({before / after if after else float("inf"):.1f}x)'
+    )
+
+
+def _legacy_espn(html):
+    import pandas as pd
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    table = soup.find("table", {"class": "engineTable"})
+    if table is None:
+        return None
+    df = pd.read_html(StringIO(str(table)))[0]
+    df['match_link'] = [
+        None if l is None else l.get('href')
+        for l in [tr.find_all('td')[-1].find('a') for tr in table.tbody.find_all('tr')]
+    ]
+    return df
+
+
+def _legacy_wiki(html):
+    import pandas as pd
+    from bs4 import BeautifulSoup
+    tabs = pd.read_html(StringIO(html), attrs={'class': 'sortable'}, flavor='bs4')
+    soup = BeautifulSoup(html, 'html.parser')
+    for sqd, t in zip(tabs, soup.find_all("table", {"class": "sortable"})):
+        flags = []
+        for row in t.find('tbody').find_all('tr'):
+            if row.find_all('th'):
+                continue
+            span = row.find_all('td')[-1].find('span', attrs={'class': 'flagicon'})
+            flags.append(span.find('a').attrs.get('title') if span else None)
+        sqd['flag'] = flags
+    return tabs
+
+
+def bench_parse(args):
+    from rugby_stats import parse_year
+    from table_extract import iter_tables, to_frame
+
+    def single_pass_wiki(html):
+        tabs = []
+        for t in iter_tables(html, 'sortable'):
+            sqd = to_frame(t)
+            sqd['flag'] = [row[-1].flag for row in t.rows]
+            tabs.append(sqd)
+        return tabs
+
+    pages = []
+    for p in args.pages:
+        with open(p, 'r', encoding='utf-8') as page:
+            pages.append(page.read())
+
+    if args.kind == 'espn':
+        before = best_of(lambda: [_legacy_espn(p) for p in pages], args.repeat)
+        after = best_of(lambda: [parse_year(0, p) for p in pages], args.repeat)
+    else:
+        before = best_of(lambda: [_legacy_wiki(p) for p in pages], args.repeat)
+        after = best_of(
+            lambda: [single_pass_wiki(p) for p in pages], args.repeat
+        )
+    report(f'{args.kind} table parsing', before, after, len(pages))
+
+
+def bench_store(args):
+    import numpy as np
+    import pandas as pd
+    from date_parsing import parse_dates
+    from match_store import MatchStore
+
+    df = pd.read_csv(args.scorecsv)
+    df['date_dt'] = parse_dates(df['date'])['date']
+    store = MatchStore(df)
+    rng = np.random.default_rng(0)
+    teams = store.teams[:20]
+    pairs = [tuple(rng.choice(teams, 2, replace=False)) for _ in range(args.queries)]
+    grounds = list(rng.choice(store.grounds, args.queries))
+    ranges = []
+    for _ in range(args.queries):
+        start = rng.integers(1871, 2018)
+        ranges.append((f'{start}-01-01', f'{start + rng.integers(1, 10)}-12-31'))
+
+    def pandas_h2h():
+        for a, b in pairs:
+            m = df[((df.home == a) & (df.away == b)) | ((df.home == b) & (df.away == a))]
+            pts_for = np.where(m.home == a, m.home_pts, m.away_pts)
+            pts_against = np.where(m.home == a, m.away_pts, m.home_pts)
+            (pts_for > pts_against).sum(), (pts_for < pts_against).sum()
+
+    def pandas_ranges():
+        for start, end in ranges:
+            df[(df.date_dt >= start) & (df.date_dt <= end)]
+
+    def pandas_grounds():
+        for g in grounds:
+            df[df.ground == g]
+
+    for name, before, after in [
+        ('head to head', pandas_h2h,
+         lambda: [store.head_to_head(a, b) for a, b in pairs]),
+        ('date range', pandas_ranges,
+         lambda: [store.matches(start=s, end=e) for s, e in ranges]),
+        ('ground', pandas_grounds,
+         lambda: [store.at_ground(g) for g in grounds]),
+    ]:
+        report(
+            name, best_of(before, args.repeat), best_of(after, args.repeat),
+            args.queries, unit='query'
+        )
+
+
+def bench_geoids(args):
+    import csv
+    import json
+    import pandas as pd
+    from rugby_geojson_tools import (
+        COUNTRY_GRPS, build_geo_index, load_geo_index,
+        geo_units_from_sov, geo_units_from_geounit
+    )
+
+    with open(args.geojson, 'r') as geoj:
+        features = json.load(geoj)['features']
+    with open(args.teamcsv, 'r') as tm_csv:
+        teams = [
+            tm for row in csv.DictReader(tm_csv)
+            for tm in COUNTRY_GRPS.get(row[args.geocol], [row[args.geocol]])
+        ]
+
+    def legacy():
+        refs = pd.DataFrame([f['properties'] for f in features])
+        for tm in teams:
+            gus = list(refs[refs['SOVEREIGNT'] == tm].GU_A3)
+            if not gus:
+                gus = list(refs[refs['GEOUNIT'] == tm].GU_A3)
+
+    def indexed():
+        index = build_geo_index(features)
+        for tm in teams:
+            if not geo_units_from_sov(tm, index):
+                geo_units_from_geounit(tm, index)
+
+    report(
+        f'geo id resolution ({len(features)} features)',
+        best_of(legacy, args.repeat), best_of(indexed, args.repeat),
+        len(teams), unit='team'
+    )
+    load_geo_index(args.geojson)
+    cached = best_of(lambda: load_geo_index(args.geojson), args.repeat)
+    print(f'cached index load: {1000 * cached:.2f} ms')
+
+
+def _legacy_label(row):
+    import datetime
+    import pandas as pd
+    outcomes = {'A': 'W', 'B': 'L'}
+    if pd.isna(row.years_played):
+        return f'<b>{row.statename}</b><br>No international representative team'
+    dt = datetime.datetime.fromtimestamp(row.ko_sec, tz=datetime.timezone.utc)
+    return (
+        f'<b>{row.team_name}</b><br>{dt.strftime("%d %b %Y")}<br>v {row.oppname}'
+        f'<br>{outcomes.get(row.outcome, "D")}'
+        f' {int(row.tm_score)} - {int(row.oppscore)}'
+    )
+
+
+def _add_plot_code_path():
+    """Make first_match_plot importable from the plots directory."""
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '..', 'plots', 'first_match', 'code'
+    ))
+
+
+def synthetic_first_match(n):
+    """
+    `n` rows of first_match_plot input over 150 years, with the
+    centroids of every map unit.
+    """
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    years = range(1871, 2021)
+    units = [f'U{i:03d}' for i in range(n // len(years) + 1)]
+    centroids = {u: [float(i % 360 - 180), float(i % 170 - 85)] for i, u in enumerate(units)}
+    year = np.repeat(np.array(years), len(units))[:n]
+    years_played = rng.integers(-1, 100, n).astype(float)
+    years_played[years_played < 0] = np.nan
+    df = pd.DataFrame({
+        'year': year,
+        'geounit': np.tile(units, len(years))[:n],
+        'colorscale': rng.random(n),
+        'years_played': years_played,
+        'statename': np.tile(units, len(years))[:n],
+        'team_name': np.tile(units, len(years))[:n],
+        'ko_sec': (year - 1970) * 31_557_600.0 + rng.integers(0, 31_557_600, n),
+        'oppname': rng.choice(units, n),
+        'outcome': rng.choice(['A', 'B', 'C'], n),
+        'tm_score': rng.integers(0, 60, n).astype(float),
+        'oppscore': rng.integers(0, 60, n).astype(float),
+    })
+    return df, centroids, years
+
+
+def bench_plotprep(args):
+    _add_plot_code_path()
+    from first_match_plot import ONE_CENTROID_TEAMS, prepare
+
+    n = args.rows
+    df, centroids, years = synthetic_first_match(n)
+
+    def legacy():
+        legacy_df = df.copy()
+        legacy_df['label'] = legacy_df.apply(_legacy_label, axis=1)
+        for y in years:
+            dfsub = legacy_df[legacy_df.year == y]
+            dfdebs = dfsub[dfsub.years_played == 0]
+            debuts = dfdebs.apply(
+                lambda x: ONE_CENTROID_TEAMS.get(x.team_name, x.geounit),
+                axis=1, result_type='reduce'
+            ).unique()
+            [centroids[d] for d in debuts]
+
+    def vectorized():
+        prepare(df.copy(), centroids, years)
+
+    report(
+        f'frame preparation ({n} rows, {len(years)} years)',
+        best_of(legacy, args.repeat), best_of(vectorized, args.repeat),
+        n / 1000, unit='1k rows'
+    )
+
+
+def _legacy_enrich(all_squads):
+    from date_parsing import parse_dates, DOB_FORMATS
+    from squad_enrich import POSITIONS
+    all_squads = all_squads.copy()
+    all_squads['dob'] = all_squads['dob'].str.split('(', expand=True)[0].str.strip()
+    all_squads['dob_dt'] = parse_dates(all_squads['dob'], DOB_FORMATS)['date'].values
+    all_squads['days_old'] = (all_squads['start_date'] - all_squads['dob_dt']).apply(lambda x: x.days)
+    all_squads.replace(POSITIONS, inplace=True)
+    return all_squads
+
+
+def bench_enrich(args):
+    import pandas as pd
+    from squad_enrich import enrich
+
+    with open(args.squadscsv, 'r') as csv_f:
+        expected = csv_f.read()
+    raw = pd.read_csv(args.squadscsv).drop(columns=['dob_dt', 'days_old'])
+    raw['start_date'] = pd.to_datetime(raw['start_date'])
+    for name, func in [('legacy', _legacy_enrich), ('vectorized', enrich)]:
+        same = func(raw).to_csv(index=False) == expected
+        print(f'{name} enrichment reproduces {args.squadscsv}: {same}')
+
+    squads = pd.concat([raw] * args.scale, ignore_index=True)
+    report(
+        f'squad enrichment ({len(squads)} players)',
+        best_of(lambda: _legacy_enrich(squads), args.repeat),
+        best_of(lambda: enrich(squads), args.repeat),
+        len(squads) / 1000, unit='1k players'
+    )
+
+
+HEAVY_MODULES = ('numpy', 'pandas', 'requests', 'lxml', 'bs4', 'plotly')
+
+# (rugby arguments, equivalent direct script arguments)
+STARTUP_COMMANDS = [
+    (['--help'], None),
+    (['export', '--help'], ['test_scores.py', '--help']),
+    (['add-geo-ids', '--help'], ['rugby_geojson_tools.py', 'add-geo-ids', '--help']),
+    (['makegeo', '--help'], ['rugby_geojson_tools.py', 'makegeo', '--help']),
+    (['scrape', '--help'], ['rugby_stats.py', '--help']),
+    (['squads', '--help'], ['wc_squads.py', '--help']),
+    (['plot', '--help'], [os.path.join(
+        '..', 'plots', 'first_match', 'code', 'first_match_plot.py'), '--help']),
+    (['serve', '--help'], ['simple_cors_http.py', '--help']),
+]
+
+
+def _heavy_imports(argv, cwd):
+    """The modules in `HEAVY_MODULES` that running `argv` imports."""
+    import subprocess
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + argv, cwd=cwd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    imported = {
+        line.rsplit('|', 1)[-1].strip().split('.')[0]
+        for line in proc.stderr.splitlines() if line.startswith('import time:')
+    }
+    return [m for m in HEAVY_MODULES if m in imported]
+
+
+def bench_startup(args):
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def start_up(argv):
+        return best_of(lambda: subprocess.run(
+            [sys.executable] + argv, cwd=here, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ), args.repeat)
+
+    print(f'interpreter: {1000 * start_up(["-c", "pass"]):.0f} ms')
+    for rugby_argv, script_argv in STARTUP_COMMANDS:
+        argv = ['rugby.py'] + rugby_argv
+        line = f'rugby {" ".join(rugby_argv)}: {1000 * start_up(argv):.0f} ms'
+        if script_argv:
+            line += f' (script {1000 * start_up(script_argv):.0f} ms)'
+        heavy = _heavy_imports(argv, here)
+        print(f'{line}, imports {", ".join(heavy) or "no heavy modules"}')
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ESPN_FIXTURE = os.path.join(FIXTURES_DIR, 'espn_results_2018.html')
+WIKI_FIXTURE = os.path.join(FIXTURES_DIR, 'wiki_squads_2019.html')
+SCORES_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'test_scores.csv'
+)
+
+# [(name, unit, setup)], see `suite_benchmark`
+SUITE = []
+
+
+def suite_benchmark(name, unit):
+    """
+    Register a benchmark of the suite. The decorated `setup(scale, workdir)`
+    prepares the input at `scale` in `workdir` and returns the function to
+    time and the number of `unit`s it processes.
+    """
+    def register(setup):
+        SUITE.append((name, unit, setup))
+        return setup
+    return register
+
+
+def read_fixture(path, scale=1):
+    """A fixture page with the data rows of every table repeated `scale` times."""
+    from copy import deepcopy
+    from lxml import html as lxml_html
+    with open(path, 'r', encoding='utf-8') as page:
+        text = page.read()
+    if scale == 1:
+        return text
+    doc = lxml_html.document_fromstring(text)
+    for table in doc.iter('table'):
+        body = table.find('tbody')
+        body = table if body is None else body
+        rows = [tr for tr in body.findall('tr') if tr.find('td') is not None]
+        for _ in range(scale - 1):
+            body.extend(deepcopy(tr) for tr in rows)
+    return lxml_html.tostring(doc, encoding='unicode', doctype='<!DOCTYPE html>')
+
+
+def synthetic_geojson(n_sovs, units_per_sov=3, vertices=32):
+    """
+    Sovereignty and map unit FeatureCollections of `n_sovs` made up
+    countries, each split into `units_per_sov` map units.
+    """
+    import math
+
+    def polygon(x, y, r):
+        ring = [
+            [round(x + r * math.cos(2 * math.pi * i / vertices), 5),
+             round(y + r * math.sin(2 * math.pi * i / vertices), 5)]
+            for i in range(vertices)
+        ]
+        return {'type': 'Polygon', 'coordinates': [ring + ring[:1]]}
+
+    sovs = []
+    units = []
+    for i in range(n_sovs):
+        x, y = i % 360 - 180, (i // 360) % 170 - 85
+        sov = f'Country {i}'
+        sovs.append({
+            'type': 'Feature',
+            'properties': {'SOVEREIGNT': sov, 'GEOUNIT': sov, 'GU_A3': f'S{i:05d}'},
+            'geometry': polygon(x, y, 0.5),
+        })
+        for j in range(units_per_sov):
+            unit = sov if j == 0 else f'{sov} Unit {j}'
+            units.append({
+                'type': 'Feature',
+                'properties': {'SOVEREIGNT': sov, 'GEOUNIT': unit,
+                               'GU_A3': f'U{i:05d}{j}'},
+                'geometry': polygon(x + 0.3 * j, y, 0.5 / units_per_sov),
+            })
+    return (
+        {'type': 'FeatureCollection', 'features': sovs},
+        {'type': 'FeatureCollection', 'features': units},
+    )
+
+
+def write_geo_inputs(workdir, n_sovs):
+    """
+    Write synthetic GeoJSONs and a team CSV naming every other country by
+    its sovereignty and the rest by one of their map units.
+    """
+    import csv
+    import json
+    sovgeo, unitgeo = synthetic_geojson(n_sovs)
+    paths = {
+        'sovgeojson': os.path.join(workdir, 'sovereignties.geojson'),
+        'mapunitgeojson': os.path.join(workdir, 'map_units.geojson'),
+        'teamcsv': os.path.join(workdir, 'teams.csv'),
+    }
+    for path, geo in ((paths['sovgeojson'], sovgeo), (paths['mapunitgeojson'], unitgeo)):
+        with open(path, 'w') as geo_f:
+            json.dump(geo, geo_f)
+    with open(paths['teamcsv'], 'w', newline='') as tm_csv:
+        writer = csv.writer(tm_csv)
+        writer.writerow(['team_name', 'geo_id'])
+        for i in range(n_sovs):
+            geo_id = f'Country {i}' if i % 2 == 0 else f'Country {i} Unit 1'
+            writer.writerow([f'Team {i}', geo_id])
+    return paths
+
+
+def synthetic_timeline(n_matches):
+    """CSV lines of `n_matches` back to back matches of 400 events each."""
+    import random
+    rng = random.Random(0)
+    header = (
+        'phase,match_time,event,label,team_id,player_id,points,x_pos,y_pos,'
+        'ex_pos,ey_pos,m_pos,info,millis,gmt_offset,score0,score1,plot,manual_label'
+    )
+    scoring = {'Try': 5, 'Conversion': 2, 'Penalty Goal': 3}
+    events = ['Ruck', 'Kick', 'Pass', 'Tackle', 'Lineout', 'Scrum', 'Carry'] * 6
+    events += list(scoring)
+    lines = [header + '\n']
+    for _ in range(n_matches):
+        score = [0, 0]
+        lines.append('U,0,Teams Out,Teams Out,39,,0,50,50,,,,,0,9,0,0,FALSE,\n')
+        for period, (start, end) in (('L1', (0, 2400)), ('L2', (2400, 4800))):
+            for i in range(199):
+                event = rng.choice(events)
+                team = rng.randrange(2)
+                points = scoring.get(event, 0)
+                score[team] += points
+                lines.append(
+                    f'{period},{start + i * (end - start) // 199},{event},{event},'
+                    f'{(39, 34)[team]},{rng.randrange(40000, 50000)},{points},'
+                    f'{rng.uniform(0, 100):.1f},{rng.uniform(0, 100):.1f},'
+                    f',,,,0,9,{score[0]},{score[1]},FALSE,\n'
+                )
+            if period == 'L1':
+                lines.append(f'LHT,2400,Half Time,,,,0,,,,,,,0,9,{score[0]},{score[1]},FALSE,\n')
+        lines.append(f'LFT,4800,Full Time,,,,0,,,,,,,0,9,{score[0]},{score[1]},FALSE,\n')
+    return lines
+
+
+def _quietly(func):
+    """`func` with its progress prints discarded."""
+    from contextlib import redirect_stdout
+
+    def run():
+        with redirect_stdout(StringIO()):
+            return func()
+    return run
+
+
+@suite_benchmark('scores.parse', 'row')
+def suite_scores_parse(scale, workdir):
+    from rugby_stats import build_scores
+    html = read_fixture(ESPN_FIXTURE, scale)
+    n_rows = len(build_scores([(2018, html)]))
+    return lambda: build_scores([(2018, html)]), n_rows
+
+
+@suite_benchmark('squads.get_flags', 'row')
+def suite_squads_get_flags(scale, workdir):
+    from table_extract import iter_tables
+    from wc_squads import get_flags
+    tables = list(iter_tables(read_fixture(WIKI_FIXTURE, scale), 'sortable'))
+    return (
+        lambda: [get_flags(t) for t in tables],
+        sum(len(t.rows) for t in tables)
+    )
+
+
+@suite_benchmark('squads.parse', 'row')
+def suite_squads_parse(scale, workdir):
+    from wc_squads import parse_squads
+    html = read_fixture(WIKI_FIXTURE, scale)
+    n_rows = sum(len(t) for t in parse_squads({2019: html})[2019])
+    return lambda: parse_squads({2019: html}), n_rows
+
+
+@suite_benchmark('squads.normalise', 'player')
+def suite_squads_normalise(scale, workdir):
+    from wc_squads import normalise_squads, parse_squads
+    import squad_enrich
+    tables = parse_squads({2019: read_fixture(WIKI_FIXTURE, scale)})[2019]
+
+    def normalise():
+        squads = normalise_squads({2019: [t.copy() for t in tables]})
+        return squad_enrich.enrich(squads)
+    return _quietly(normalise), len(_quietly(normalise)())
+
+
+@suite_benchmark('scores.export', 'row')
+def suite_scores_export(scale, workdir):
+    from test_scores import iter_rows, write_json
+    path = os.path.join(workdir, 'test_scores.csv')
+    with open(SCORES_CSV, 'r') as in_f:
+        header = in_f.readline()
+        body = in_f.read()
+    with open(path, 'w') as out_f:
+        out_f.write(header)
+        for _ in range(scale):
+            out_f.write(body)
+    return (
+        lambda: write_json(iter_rows(path), StringIO()),
+        write_json(iter_rows(path), StringIO())
+    )
+
+
+@suite_benchmark('geo.add_geo_ids', 'team')
+def suite_add_geo_ids(scale, workdir):
+    from argparse import Namespace
+    from rugby_geojson_tools import add_geo_ids
+    n_sovs = 200 * scale
+    paths = write_geo_inputs(workdir, n_sovs)
+    args = Namespace(
+        geojson=paths['mapunitgeojson'], teamcsv=paths['teamcsv'],
+        outcsv=os.path.join(workdir, 'teams_geo.csv'), geocol='geo_id'
+    )
+
+    def run():
+        # Time a cold run, including building the geo index
+        index_path = args.geojson + '.index.json'
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        add_geo_ids(args)
+    return run, n_sovs
+
+
+@suite_benchmark('geo.mk_geojson', 'feature')
+def suite_mk_geojson(scale, workdir):
+    from argparse import Namespace
+    from rugby_geojson_tools import mk_geojson
+    n_sovs = 200 * scale
+    args = Namespace(
+        **write_geo_inputs(workdir, n_sovs),
+        outgeojson=os.path.join(workdir, 'out.geojson'), geocol='geo_id'
+    )
+    return lambda: mk_geojson(args), 4 * n_sovs
+
+
+@suite_benchmark('timeline.aggregate', 'event')
+def suite_timeline(scale, workdir):
+    from match_timeline import SnapshotWriter, TimelineAggregates, process
+    lines = synthetic_timeline(scale)
+
+    def run():
+        writer = SnapshotWriter(os.devnull)
+        try:
+            process(lines, TimelineAggregates(), writer)
+        finally:
+            writer.close()
+    return run, len(lines) - 1
+
+
+@suite_benchmark('first_match.frames', 'row')
+def suite_first_match_frames(scale, workdir):
+    _add_plot_code_path()
+    os.environ.setdefault('MAPBOX_TOKEN', '')
+    from first_match_plot import make_figure, make_layout, prepare
+    df, centroids, years = synthetic_first_match(20_000 * scale)
+    sovgeo, _ = synthetic_geojson(len(centroids))
+    layout = make_layout()
+
+    def run():
+        # Figure dicts only, nothing is written or rasterised
+        slices = prepare(df.copy(), centroids, years)
+        for y, dfsub in slices.items():
+            make_figure(y, dfsub, sovgeo, layout)
+    return run, len(df)
+
+
+def _git_commit():
+    import subprocess
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new, threshold):
+    """Print the change in best time of each benchmark; return the regressions."""
+    old_best = {(r['name'], r['scale']): r['best'] for r in old['results']}
+    regressions = []
+    print(f'Compared with {old.get("commit") or "unknown commit"}:')
+    for r in new['results']:
+        key = (r['name'], r['scale'])
+        if key not in old_best:
+            continue
+        ratio = r['best'] / old_best[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' SLOWER'
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = ' faster'
+        print(f'  {r["name"]:<20} x{r["scale"]:<5} {ratio:6.2f}x time{flag}')
+    return regressions
+
+
+def run_suite(args):
+    import json
+    import platform
+    import tempfile
+    from datetime import datetime, timezone
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, unit, setup in SUITE:
+            if args.filter and args.filter not in name:
+                continue
+            for scale in args.scales:
+                workdir = os.path.join(tmpdir, f'{name}-{scale}')
+                os.makedirs(workdir)
+                func, n_items = setup(scale, workdir)
+                times = timeit.repeat(func, number=1, repeat=args.repeat)
+                best = min(times)
+                results.append({
+                    'name': name, 'scale': scale, 'n_items': n_items,
+                    'unit': unit, 'best': best, 'mean': sum(times) / len(times),
+                })
+                print(
+                    f'{name:<20} x{scale:<5} {n_items:>8} {unit}s '
+                    f'{1000 * best:10.2f} ms '
+                    f'({1e6 * best / n_items:.2f} us/{unit})'
+                )
+    doc = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as out_f:
+            json.dump(doc, out_f, indent=2)
+        print(f'Wrote results to {args.out}')
+    if args.compare:
+        with open(args.compare, 'r') as old_f:
+            return compare_results(json.load(old_f), doc, args.threshold)
+    return []
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.program == 'parse':
+        bench_parse(args)
+    elif args.program == 'store':
+        bench_store(args)
+    elif args.program == 'geoids':
+        bench_geoids(args)
+    elif args.program == 'plotprep':
+        bench_plotprep(args)
+    elif args.program == 'enrich':
+        bench_enrich(args)
+    elif args.program == 'startup':
+        bench_startup(args)
+    elif args.program == 'suite':
+        if run_suite(args):
+            sys.exit(1)
@@ -0,0 +1,49 @@
+DAY = 'day'
+MONTH = 'month'
+YEAR = 'year'
+
+# (strptime format, regex identifying the format, precision)
+SCORE_DATE_FORMATS = (
+    ('%d %b %Y', r'^\d{1,2} [A-Za-z]{3} \d{4}$', DAY),
+    ('%b %Y', r'^[A-Za-z]{3} \d{4}$', MONTH),
+    ('%Y', r'^\d{4}$', YEAR),
+)
+DOB_FORMATS = (
+    ('%d %B %Y', r'^\d{1,2} [A-Za-z]+ \d{4}$', DAY),
+    ('%B %d, %Y', r'^[A-Za-z]+ \d{1,2}, \d{4}$', DAY),
+)
+
+
+def parse_dates(values, formats=SCORE_DATE_FORMATS):
+    """
+    Parse a column of date strings that mixes several formats.
+
+    Each distinct string is parsed once: the distinct values are classified
+    by format and every format group is parsed with a single vectorized
+    `pd.to_datetime` call. Returns a DataFrame with a `date` column (NaT
+    where no format matched) and a `precision` column saying whether the
+    date is known to the day, month or year.
+    """
+    import pandas as pd
+
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniq = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    dates = pd.Series(pd.NaT, index=uniq.index, dtype='datetime64[ns]')
+    precision = pd.Series(None, index=uniq.index, dtype=object)
+    for fmt, pattern, prec in formats:
+        mask = uniq.str.match(pattern) & dates.isna()
+        if not mask.any():
+            continue
+        dates[mask] = pd.to_datetime(uniq[mask], format=fmt, errors='coerce')
+        precision[mask & dates.notna()] = prec
+
+    # Append a missing entry for factorize's -1 (NaN) code to pick up
+    dates = pd.concat([dates, pd.Series([pd.NaT], dtype=dates.dtype)])
+    precision = pd.concat([precision, pd.Series([None], dtype=object)])
+    return pd.DataFrame({
+        'date': dates.to_numpy()[codes],
+        'precision': pd.Categorical(
+            precision.to_numpy()[codes], categories=[DAY, MONTH, YEAR]
+        ),
+    }, index=values.index)
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import count
+
+
+log = logging.getLogger('Fetcher')
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Space out requests to each host by at least `1 / rate` seconds."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Fetcher:
+    """
+    Fetch pages over one pooled `requests.Session` with a bounded thread pool.
+
+    Requests to the same host are rate limited and connection errors or
+    retryable status codes are retried with exponential backoff. If a
+    `ResponseCache` is given, pages are served from it where possible.
+    """
+
+    def __init__(self, jobs=1, rate=None, retries=3, backoff=0.5, timeout=30,
+                 session=None, cache=None):
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.jobs, pool_maxsize=self.jobs
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def get(self, url, frozen=None):
+        """
+        Fetch `url`. `frozen` is the time from which the page no longer
+        changes (see `ResponseCache`); once cached after that it is not
+        revalidated.
+        """
+        headers = {}
+        if self.cache is not None:
+            cached, headers = self.cache.lookup(url, frozen=frozen)
+            if cached is not None:
+                count('http.cache_hits')
+                return cached
+        resp = self._get(url, headers)
+        if self.cache is not None:
+            if resp.status_code == 304:
+                cached = self.cache.revalidated(url, frozen=frozen)
+                if cached is not None:
+                    count('http.revalidated')
+                    return cached
+                resp = self._get(url, {})
+            self.cache.store(url, resp, frozen=frozen)
+        return resp
+
+    def _get(self, url, headers):
+        attempt = 0
+        while True:
+            self.limiter.wait(url)
+            count('http.requests')
+            try:
+                resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as err:
+                if attempt >= self.retries:
+                    raise
+                log.warning('Error fetching %s (%s), retrying', url, err)
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return resp
+                log.warning('Got %s for %s, retrying', resp.status_code, url)
+            count('http.retries')
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def get_many(self, urls, frozen=None):
+        """
+        Fetch all `urls` concurrently, returning responses in input order.
+
+        `frozen` is an optional function giving the time from which a URL's
+        content no longer changes, or None if it may still change.
+        """
+        urls = list(urls)
+        flags = [frozen(u) if frozen else None for u in urls]
+        if self.jobs == 1 or len(urls) < 2:
+            return [self.get(u, f) for u, f in zip(urls, flags)]
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            return list(pool.map(self.get, urls, flags))
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.flush()
+            self.cache.log_stats()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,338 @@
+import json
+import logging
+
+import numpy as np
+
+
+log = logging.getLogger('GeoJSON Tools')
+
+
+def zoom_tolerance(zoom, pixels=0.5):
+    """Tolerance in degrees of `pixels` web map pixels at `zoom`."""
+    return 360.0 / (256 * 2 ** zoom) * pixels
+
+
+class Topology:
+    """
+    Shared-arc topology of the polygons in a GeoJSON FeatureCollection.
+
+    Coordinates are quantized onto a `quantize` x `quantize` grid over the
+    bounding box, then every ring is cut at the junctions where it meets a
+    different neighbour. Arcs shared by two rings are stored once, so
+    simplifying each arc once keeps shared borders identical on both sides.
+    """
+
+    def __init__(self, geojson, quantize=1e6):
+        self.features = geojson['features']
+        coords = [
+            ring for f in self.features for ring in _polygon_rings(f['geometry'])
+        ]
+        all_pts = np.concatenate(coords) if coords else np.zeros((0, 2))
+        self.n_points = len(all_pts)
+        lo = all_pts.min(axis=0) if len(all_pts) else np.zeros(2)
+        hi = all_pts.max(axis=0) if len(all_pts) else np.ones(2)
+        self.translate = lo
+        self.scale = np.where(hi > lo, (hi - lo) / (quantize - 1), 1.0)
+        self.quantize = int(quantize)
+        self.quantization_error = float(np.max(
+            np.abs(self.dequantize(self.quantize_pts(all_pts)) - all_pts)
+        )) if len(all_pts) else 0.0
+
+        self.arcs = []
+        self._arc_ids = {}
+        self.geometries = [self._geometry(f['geometry']) for f in self.features]
+
+    def quantize_pts(self, pts):
+        return np.round((np.asarray(pts, dtype=float) - self.translate) / self.scale).astype(np.int64)
+
+    def dequantize(self, qpts):
+        return qpts * self.scale + self.translate
+
+    def _geometry(self, geom):
+        if geom is None:
+            return None
+        if geom['type'] == 'Polygon':
+            return {'type': 'Polygon', 'arcs': self._polygon(geom['coordinates'])}
+        if geom['type'] == 'MultiPolygon':
+            return {'type': 'MultiPolygon',
+                    'arcs': [self._polygon(p) for p in geom['coordinates']]}
+        if geom['type'] in ('Point', 'MultiPoint'):
+            return dict(geom)
+        raise ValueError(f'Unsupported geometry type {geom["type"]}')
+
+    def _polygon(self, rings):
+        return [self._pending_ring(self.quantize_pts(r)) for r in rings]
+
+    def _pending_ring(self, ring):
+        # Rings are cut into arcs once all junctions are known, see _cut
+        if len(ring) > 1:
+            # Drop points made duplicate by quantization and the closing point
+            ring = ring[np.append(True, np.any(np.diff(ring, axis=0) != 0, axis=1))]
+            if len(ring) > 1 and (ring[0] == ring[-1]).all():
+                ring = ring[:-1]
+        self.arcs.append(ring)
+        return len(self.arcs) - 1
+
+    def build(self):
+        """Find junctions across all rings and cut the rings into shared arcs."""
+        rings = self.arcs
+        self.arcs = []
+        keys = [r[:, 0] * self.quantize + r[:, 1] for r in rings]
+        is_junction = np.isin(
+            np.concatenate(keys) if keys else np.array([], dtype=np.int64),
+            _junctions(keys)
+        )
+        offsets = np.cumsum([len(k) for k in keys])[:-1]
+        ring_arcs = [
+            self._cut(r, k, np.flatnonzero(j))
+            for r, k, j in zip(rings, keys, np.split(is_junction, offsets))
+        ]
+        for geom in self.geometries:
+            if geom is None or 'arcs' not in geom:
+                continue
+            if geom['type'] == 'Polygon':
+                geom['arcs'] = [ring_arcs[r] for r in geom['arcs']]
+            else:
+                geom['arcs'] = [[ring_arcs[r] for r in p] for p in geom['arcs']]
+        log.info(
+            'Built topology: %d points, %d rings, %d arcs',
+            self.n_points, len(rings), len(self.arcs)
+        )
+        return self
+
+    def _arc_id(self, arc):
+        key = arc.tobytes()
+        if key in self._arc_ids:
+            return self._arc_ids[key]
+        rev_key = arc[::-1].tobytes()
+        if rev_key in self._arc_ids:
+            return ~self._arc_ids[rev_key]
+        self.arcs.append(arc)
+        self._arc_ids[key] = len(self.arcs) - 1
+        return len(self.arcs) - 1
+
+    def _cut(self, ring, keys, cuts):
+        if not len(ring):
+            return []
+        if not len(cuts):
+            # Closed ring with no neighbours: start it at its smallest point
+            # so a ring shared in full (e.g. an enclave) is still matched
+            ring = np.roll(ring, -np.argmin(keys), axis=0)
+            return [self._arc_id(np.vstack([ring, ring[:1]]))]
+        ring = np.roll(ring, -cuts[0], axis=0)
+        ring = np.vstack([ring, ring[:1]])
+        cuts = np.append(cuts - cuts[0], len(ring) - 1)
+        return [
+            self._arc_id(ring[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])
+        ]
+
+    def simplify(self, tolerance):
+        """
+        Douglas-Peucker simplify every arc with `tolerance` (in degrees).
+
+        Returns the kept quantized points of each arc and the largest
+        distance of any dropped point from the simplified line.
+        """
+        simplified = []
+        max_error = 0.0
+        for arc in self.arcs:
+            keep, err = douglas_peucker(self.dequantize(arc), tolerance)
+            if arc.shape[0] > 3 and (arc[0] == arc[-1]).all() and keep.sum() < 4:
+                # Keep enough of a closed ring for it to stay a polygon
+                keep[np.linspace(0, len(arc) - 1, 4).astype(int)] = True
+                err = max(err, _max_dp_error(self.dequantize(arc), keep))
+            simplified.append(arc[keep])
+            max_error = max(max_error, err)
+        return simplified, max_error
+
+
+def _polygon_rings(geom):
+    if geom is None:
+        return []
+    if geom['type'] == 'Polygon':
+        return [np.asarray(r, dtype=float)[:, :2] for r in geom['coordinates']]
+    if geom['type'] == 'MultiPolygon':
+        return [
+            np.asarray(r, dtype=float)[:, :2]
+            for p in geom['coordinates'] for r in p
+        ]
+    return []
+
+
+def _junctions(keys):
+    """
+    Point keys where rings meet different neighbours.
+
+    A point shared by several rings is a junction unless every ring passes
+    through it between the same two neighbouring points.
+    """
+    keys = [k for k in keys if len(k)]
+    if not keys:
+        return np.array([], dtype=np.int64)
+    point = np.concatenate(keys)
+    prev = np.concatenate([np.roll(k, 1) for k in keys])
+    nxt = np.concatenate([np.roll(k, -1) for k in keys])
+    uniq = np.unique(
+        np.stack([point, np.minimum(prev, nxt), np.maximum(prev, nxt)], axis=1),
+        axis=0
+    )
+    pts, counts = np.unique(uniq[:, 0], return_counts=True)
+    return pts[counts > 1]
+
+
+def _segment_distances(pts, a, b):
+    ab = b - a
+    denom = float(ab @ ab)
+    if denom == 0:
+        return np.hypot(*(pts - a).T)
+    t = np.clip(((pts - a) @ ab) / denom, 0, 1)
+    proj = a + t[:, None] * ab
+    return np.hypot(*(pts - proj).T)
+
+
+def douglas_peucker(pts, tolerance):
+    """
+    Return a keep mask for `pts` and the max distance of dropped points.
+
+    The first and last points are always kept.
+    """
+    n = len(pts)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    max_error = 0.0
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dists = _segment_distances(pts[first + 1:last], pts[first], pts[last])
+        idx = int(np.argmax(dists))
+        if dists[idx] > tolerance:
+            mid = first + 1 + idx
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+        else:
+            max_error = max(max_error, float(dists[idx]))
+    return keep, max_error
+
+
+def _max_dp_error(pts, keep):
+    kept = np.flatnonzero(keep)
+    err = 0.0
+    for a, b in zip(kept[:-1], kept[1:]):
+        if b - a > 1:
+            err = max(err, float(_segment_distances(pts[a + 1:b], pts[a], pts[b]).max()))
+    return err
+
+
+def _ring_coords(arc_ids, arcs):
+    """Stitch arcs (negative ids reversed) back into a ring of points."""
+    parts = []
+    for i in arc_ids:
+        arc = arcs[~i][::-1] if i < 0 else arcs[i]
+        parts.append(arc if not parts else arc[1:])
+    return np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int64)
+
+
+def to_geojson(topo, arcs, decimals=None):
+    """
+    Rebuild a GeoJSON FeatureCollection from simplified arcs.
+
+    Rings which collapse to fewer than four positions are dropped, along
+    with polygons whose outer ring collapsed.
+    """
+    def ring(arc_ids):
+        coords = topo.dequantize(_ring_coords(arc_ids, arcs))
+        if decimals is not None:
+            coords = np.round(coords, decimals)
+        return coords.tolist() if len(coords) >= 4 else None
+
+    def polygon(rings):
+        rings = [ring(r) for r in rings]
+        if not rings or rings[0] is None:
+            return None
+        return [r for r in rings if r is not None]
+
+    features = []
+    for f, geom in zip(topo.features, topo.geometries):
+        new_geom = geom
+        if geom is not None and geom['type'] == 'Polygon':
+            coords = polygon(geom['arcs'])
+            new_geom = {'type': 'Polygon', 'coordinates': coords} if coords else None
+        elif geom is not None and geom['type'] == 'MultiPolygon':
+            polys = [p for p in (polygon(p) for p in geom['arcs']) if p]
+            new_geom = {'type': 'MultiPolygon', 'coordinates': polys} if polys else None
+        features.append({**f, 'geometry': new_geom})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def to_topojson(topo, arcs, object_name='features'):
+    """Encode the simplified arcs as a quantized, delta-encoded TopoJSON."""
+    geometries = []
+    for f, geom in zip(topo.features, topo.geometries):
+        if geom is None:
+            out = {'type': None}
+        elif geom['type'] in ('Point', 'MultiPoint'):
+            out = {
+                'type': geom['type'],
+                'coordinates': topo.quantize_pts(
+                    np.reshape(geom['coordinates'], (-1, 2))
+                ).tolist()
+            }
+            if geom['type'] == 'Point':
+                out['coordinates'] = out['coordinates'][0]
+        else:
+            out = {'type': geom['type'], 'arcs': geom['arcs']}
+        if 'id' in f:
+            out['id'] = f['id']
+        out['properties'] = f.get('properties', {})
+        geometries.append(out)
+    return {
+        'type': 'Topology',
+        'transform': {
+            'scale': topo.scale.tolist(),
+            'translate': topo.translate.tolist(),
+        },
+        'objects': {
+            object_name: {'type': 'GeometryCollection', 'geometries': geometries}
+        },
+        'arcs': [
+            np.vstack([a[:1], np.diff(a, axis=0)]).tolist() for a in arcs
+        ],
+    }
+
+
+def simplify_file(geojson_path, outputs, quantize=1e6, topojson=False):
+    """
+    Simplify `geojson_path` once per `(tolerance, outpath)` in `outputs`,
+    writing GeoJSON or TopoJSON. Returns a list of report dicts.
+    """
+    with open(geojson_path, 'r') as geoj:
+        raw = geoj.read()
+    topo = Topology(json.loads(raw), quantize=quantize).build()
+    # Enough decimals to represent the quantization grid
+    decimals = int(max(0, np.ceil(-np.log10(topo.scale.min())))) + 1
+
+    reports = []
+    for tolerance, outpath in outputs:
+        arcs, simplify_error = topo.simplify(tolerance)
+        if topojson:
+            out = to_topojson(topo, arcs)
+        else:
+            out = to_geojson(topo, arcs, decimals)
+        text = json.dumps(out, separators=(',', ':'))
+        with open(outpath, 'w') as outf:
+            outf.write(text)
+        reports.append({
+            'output': outpath,
+            'tolerance': tolerance,
+            'points_in': topo.n_points,
+            'points_out': int(sum(len(a) for a in arcs)),
+            'bytes_in': len(raw.encode('utf-8')),
+            'bytes_out': len(text.encode('utf-8')),
+            'simplify_error': simplify_error,
+            'quantization_error': topo.quantization_error,
+            'max_error': simplify_error + topo.quantization_error,
+        })
+    return reports
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger('HTTP Cache')
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'RUGBY_STATS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'rugby-stats')
+)
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP response bodies keyed by URL.
+
+    Entries are evicted least recently used first once the total size goes
+    over `max_bytes`. Entries younger than `max_age` seconds are served
+    without touching the network, older ones are revalidated with their
+    ETag/Last-Modified. Frozen entries (e.g. seasons long finished) never
+    expire. Access times are written with the next store or by `flush`.
+
+    Callers mark a page as frozen by passing `frozen`, the time (seconds
+    since the epoch) from which its content no longer changes, or True if
+    it never does. Only entries stored at or after that time are frozen; an
+    older entry is revalidated once and frozen when refreshed.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=512 * 2**20,
+                 max_age=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.json')
+        try:
+            with open(self._index_path, 'r') as idx:
+                self._index = json.load(idx)
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+    @staticmethod
+    def _frozen_at(stored, frozen):
+        """Whether an entry stored at `stored` is final given `frozen`."""
+        if frozen is None or frozen is False:
+            return False
+        return frozen is True or stored >= frozen
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _body_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _save_index(self):
+        tmp = self._index_path + '.tmp'
+        with open(tmp, 'w') as idx:
+            json.dump(self._index, idx)
+        os.replace(tmp, self._index_path)
+        self._dirty = False
+
+    def flush(self):
+        """Save access times recorded since the index was last written."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def lookup(self, url, frozen=None):
+        """
+        Return `(response, headers)` for `url`.
+
+        `response` is the cached response if it can be served as is,
+        otherwise None and `headers` holds any conditional request headers.
+        """
+        with self._lock:
+            entry = self._index.get(self.key(url))
+            if entry is None:
+                return None, {}
+            entry['accessed'] = time.time()
+            self._dirty = True
+            # Stored before the page stopped changing: revalidate it once
+            stale = False
+            if not entry.get('frozen') and frozen not in (None, False):
+                if self._frozen_at(entry['stored'], frozen):
+                    entry['frozen'] = True
+                else:
+                    stale = True
+            if entry.get('frozen') or (
+                    not stale and time.time() - entry['stored'] < self.max_age):
+                resp = self._load(url, entry)
+                if resp is not None:
+                    self.stats['hits'] += 1
+                    return resp, {}
+                return None, {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return None, headers
+
+    def revalidated(self, url, frozen=None):
+        """
+        Refresh the entry for `url` after a 304 and return it, or None if it
+        was evicted in the meantime.
+        """
+        with self._lock:
+            entry = self._index.get(self.key(url))
+            if entry is None:
+                return None
+            entry['stored'] = time.time()
+            if self._frozen_at(entry['stored'], frozen):
+                entry['frozen'] = True
+            self.stats['revalidated'] += 1
+            self._save_index()
+            return self._load(url, entry)
+
+    def store(self, url, resp, frozen=None):
+        with self._lock:
+            self.stats['misses'] += 1
+        if resp.status_code != 200:
+            return
+        key = self.key(url)
+        with self._lock:
+            with open(self._body_path(key), 'wb') as body:
+                body.write(resp.content)
+            now = time.time()
+            self._index[key] = {
+                'url': url,
+                'size': len(resp.content),
+                'encoding': resp.encoding,
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'stored': now,
+                'accessed': now,
+                'frozen': self._frozen_at(now, frozen),
+            }
+            self._evict(keep=key)
+            self._save_index()
+
+    def _evict(self, keep=None):
+        total = sum(e['size'] for e in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda e: e[1]['accessed']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry['size']
+            del self._index[key]
+            try:
+                os.remove(self._body_path(key))
+            except FileNotFoundError:
+                pass
+            self.stats['evicted'] += 1
+
+    def _load(self, url, entry):
+        import requests
+
+        try:
+            with open(self._body_path(self.key(url)), 'rb') as body:
+                content = body.read()
+        except FileNotFoundError:
+            del self._index[self.key(url)]
+            return None
+        resp = requests.Response()
+        resp._content = content
+        resp.status_code = 200
+        resp.url = url
+        resp.encoding = entry.get('encoding')
+        return resp
+
+    def log_stats(self):
+        log.info(
+            'Cache hits: %(hits)d, misses: %(misses)d, '
+            'revalidated: %(revalidated)d, evicted: %(evicted)d',
+            self.stats
+        )
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+log = logging.getLogger('Instrumentation')
+ch = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s | %(name)s | %(levelname)7s | %(message)s",
+    "%Y-%m-%d %H:%M:%S"
+)
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+COLLAPSED_EXTENSIONS = ('.collapsed', '.folded')
+
+
+def add_arguments(parser):
+    """Add the `--profile` and `--metrics-json` options to `parser`."""
+    parser.add_argument(
+        '--profile', type=str, default=None,
+        help=('Profile the run to this file: collapsed stacks for flame '
+              'graphs if it ends in .collapsed or .folded, else cProfile stats')
+    )
+    parser.add_argument(
+        '--metrics-json', type=str, default=None,
+        help='Write stage timings, counters and peak RSS to this JSON at exit'
+    )
+
+
+def peak_rss(who='self'):
+    """
+    Peak resident set size in bytes of the process, or of its largest
+    finished child process with `who='children'`. None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(
+        resource.RUSAGE_CHILDREN if who == 'children' else resource.RUSAGE_SELF
+    ).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _children_usage():
+    """CPU seconds and peak RSS of finished child processes, None if unknown."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+class Metrics:
+    """
+    Stage timings, counters and peak RSS of one run.
+
+    Stages are timed with `timer` (a context manager) or `timed` (a
+    decorator); a stage entered several times accumulates its calls and
+    seconds. The peak RSS is sampled as each stage ends, and that of child
+    processes is only reported if any finished during the run (the usage
+    inherited from a launcher, e.g. a shell, is left out). Counters are
+    safe to update from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._children_start = _children_usage()
+        self.stages = {}
+        self.counters = Counter()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time the block as stage `name`. The yielded dict's `secs` is set to
+        the time taken by this call when the block exits.
+        """
+        call = {'secs': None}
+        start = time.perf_counter()
+        try:
+            yield call
+        finally:
+            elapsed = call['secs'] = time.perf_counter() - start
+            rss = peak_rss()
+            with self._lock:
+                stage = self.stages.setdefault(
+                    name, {'calls': 0, 'secs': 0.0, 'peak_rss_bytes': None}
+                )
+                stage['calls'] += 1
+                stage['secs'] += elapsed
+                stage['peak_rss_bytes'] = rss
+            log.debug('Stage %s took %.3fs', name, elapsed)
+
+    def timed(self, name=None):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        children_ran = _children_usage() != self._children_start
+        with self._lock:
+            return {
+                'started': self.started.isoformat(timespec='seconds'),
+                'wall_secs': time.perf_counter() - self._start,
+                'cpu_secs': time.process_time() - self._cpu_start,
+                'peak_rss_bytes': peak_rss(),
+                'peak_child_rss_bytes': (
+                    peak_rss('children') if children_ran else None
+                ),
+                'stages': {k: dict(v) for k, v in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+
+METRICS = Metrics()
+count = METRICS.count
+timer = METRICS.timer
+timed = METRICS.timed
+
+
+class StackSampler:
+    """
+    Sample the stack of every thread each `interval` seconds, counting
+    identical stacks in the collapsed format read by flamegraph.pl and
+    speedscope: `thread;outer;...;inner count`.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler', daemon=True
+        )
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        return f'{module}:{code.co_name}'
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as out_f:
+            for stack, n in self.stacks.most_common():
+                out_f.write(f'{stack} {n}\n')
+
+
+class Profiler:
+    """cProfile or `StackSampler` profiling, chosen by the output file name."""
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(COLLAPSED_EXTENSIONS):
+            self._profiler = StackSampler()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if isinstance(self._profiler, StackSampler):
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if isinstance(self._profiler, StackSampler):
+            self._profiler.stop()
+            self._profiler.write(self.path)
+            log.info(
+                'Wrote %d sampled stacks to %s',
+                len(self._profiler.stacks), self.path
+            )
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path)
+            log.info(
+                'Wrote profile to %s (view with python -m pstats %s)',
+                self.path, self.path
+            )
+
+
+def write_metrics(path, summary):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as out_f:
+        json.dump(summary, out_f, indent=2)
+    os.replace(tmp, path)
+
+
+def _format_summary(summary):
+    stages = ' | '.join(
+        f'{name}: {s["secs"]:.2f}s' for name, s in summary['stages'].items()
+    )
+    counters = ', '.join(f'{k}={v}' for k, v in sorted(summary['counters'].items()))
+    rss = summary['peak_rss_bytes']
+    return (
+        f'{summary["wall_secs"]:.2f}s wall, {summary["cpu_secs"]:.2f}s CPU'
+        + (f', peak RSS {rss / 2**20:.0f} MiB' if rss else '')
+        + (f'; stages {stages}' if stages else '')
+        + (f'; {counters}' if counters else '')
+    )
+
+
+@contextmanager
+def instrumented(args, metrics=METRICS):
+    """
+    Run the body under `args.profile` and write `args.metrics_json` when it
+    exits, however it exits. The summary is logged at INFO level.
+    """
+    log.setLevel(max([50 - getattr(args, 'verbosity', 0) * 10, 10]))
+    profiler = Profiler(args.profile) if args.profile else None
+    if profiler:
+        profiler.start()
+    status, exit_code = 'ok', 0
+    try:
+        yield metrics
+    except SystemExit as err:
+        if err.code is None or isinstance(err.code, int):
+            exit_code = err.code or 0
+        else:
+            exit_code = 1
+        status = 'ok' if not exit_code else 'error'
+        raise
+    except BaseException:
+        status, exit_code = 'error', 1
+        raise
+    finally:
+        if profiler:
+            profiler.stop()
+        summary = dict(
+            metrics.summary(), command=sys.argv, status=status,
+            exit_code=exit_code
+        )
+        log.info('Run summary: %s', _format_summary(summary))
+        if args.metrics_json:
+            write_metrics(args.metrics_json, summary)
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_dates
+from snapshots import load_csv
+
+
+def _postings(keys, rows):
+    """Group `rows` by integer `keys`, returning {key: sorted row array}."""
+    order = np.lexsort((rows, keys))
+    keys = keys[order]
+    rows = rows[order]
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], bounds))
+    return {
+        int(keys[s]): r for s, r in zip(starts, np.split(rows, bounds))
+    } if len(keys) else {}
+
+
+class MatchStore:
+    """
+    Array-backed, indexed store of test match results.
+
+    Rows are sorted by date and teams and grounds are integer coded. Per
+    team, per (team, opponent) pair and per ground posting lists hold the
+    row numbers of each group's matches in date order, so lookups only
+    touch the matching rows and date ranges are binary searched.
+    """
+
+    def __init__(self, scores):
+        parsed = parse_dates(scores['date'])
+        order = np.argsort(parsed['date'].to_numpy(), kind='stable')
+        scores = scores.iloc[order].reset_index(drop=True)
+        self.dates = parsed['date'].to_numpy()[order].astype('datetime64[D]')
+        self.date_precision = parsed['precision'].to_numpy()[order]
+
+        n = len(scores)
+        team_codes, self.teams = pd.factorize(
+            pd.concat([scores['home'], scores['away']], ignore_index=True)
+        )
+        self.teams = list(self.teams)
+        self.team_ids = {t: i for i, t in enumerate(self.teams)}
+        self.home = team_codes[:n].astype(np.int32)
+        self.away = team_codes[n:].astype(np.int32)
+        self.home_pts = scores['home_pts'].to_numpy().astype(np.int16)
+        self.away_pts = scores['away_pts'].to_numpy().astype(np.int16)
+        ground_codes, grounds = pd.factorize(scores['ground'])
+        self.grounds = list(grounds)
+        self.ground_ids = {g: i for i, g in enumerate(self.grounds)}
+        self.ground = ground_codes.astype(np.int32)
+        self.series = scores['series'].astype(object).to_numpy()
+
+        rows = np.arange(n)
+        both_rows = np.concatenate((rows, rows))
+        self._by_team = _postings(
+            np.concatenate((self.home, self.away)), both_rows
+        )
+        n_teams = len(self.teams)
+        lo = np.minimum(self.home, self.away).astype(np.int64)
+        hi = np.maximum(self.home, self.away).astype(np.int64)
+        self._n_teams = n_teams
+        self._by_pair = _postings(lo * n_teams + hi, rows)
+        self._by_ground = _postings(self.ground, rows)
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        # Categorical team, ground and series columns factorize cheaply
+        return cls(load_csv(csv_path, categorical=True))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _date_slice(self, idx, start=None, end=None):
+        if start is None and end is None:
+            return idx
+        dates = self.dates[idx]
+        lo = 0 if start is None else np.searchsorted(
+            dates, np.datetime64(start, 'D'), side='left')
+        if end is None:
+            # Matches with no date (NaT) sort last and are outside any range
+            hi = np.searchsorted(dates, np.datetime64('NaT'), side='left')
+        else:
+            hi = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+        return idx[lo:hi]
+
+    def matches(self, team=None, opponent=None, start=None, end=None, ground=None):
+        """
+        Row numbers of matches, in date order, filtered by team, opponent,
+        an inclusive date range and ground. Unknown names match nothing.
+        """
+        empty = np.array([], dtype=np.int64)
+        if team is not None and opponent is not None:
+            a = self.team_ids.get(team)
+            b = self.team_ids.get(opponent)
+            if a is None or b is None:
+                return empty
+            key = min(a, b) * self._n_teams + max(a, b)
+            idx = self._by_pair.get(key, empty)
+        elif team is not None or opponent is not None:
+            code = self.team_ids.get(team if team is not None else opponent)
+            idx = self._by_team.get(code, empty)
+        else:
+            idx = np.arange(len(self))
+        if ground is not None:
+            idx = np.intersect1d(
+                idx, self._by_ground.get(self.ground_ids.get(ground), empty),
+                assume_unique=True
+            )
+        return self._date_slice(idx, start, end)
+
+    def at_ground(self, ground, start=None, end=None):
+        return self.matches(ground=ground, start=start, end=end)
+
+    def _results(self, team, idx):
+        """Points for/against `team` in the matches at rows `idx`."""
+        code = self.team_ids[team]
+        is_home = self.home[idx] == code
+        pts_for = np.where(is_home, self.home_pts[idx], self.away_pts[idx])
+        pts_against = np.where(is_home, self.away_pts[idx], self.home_pts[idx])
+        return pts_for.astype(np.int64), pts_against.astype(np.int64)
+
+    def head_to_head(self, team, opponent, start=None, end=None):
+        """Record of `team` against `opponent`."""
+        idx = self.matches(team, opponent, start, end)
+        if not len(idx):
+            return {'played': 0, 'won': 0, 'drawn': 0, 'lost': 0,
+                    'points_for': 0, 'points_against': 0}
+        pts_for, pts_against = self._results(team, idx)
+        return {
+            'played': int(len(idx)),
+            'won': int((pts_for > pts_against).sum()),
+            'drawn': int((pts_for == pts_against).sum()),
+            'lost': int((pts_for < pts_against).sum()),
+            'points_for': int(pts_for.sum()),
+            'points_against': int(pts_against.sum()),
+        }
+
+    def records(self, start=None, end=None):
+        """Overall won/drawn/lost record of every team, as a DataFrame."""
+        idx = self._date_slice(np.arange(len(self)), start, end)
+        home, away = self.home[idx], self.away[idx]
+        diff = self.home_pts[idx].astype(np.int64) - self.away_pts[idx]
+        n = len(self.teams)
+        won = (np.bincount(home[diff > 0], minlength=n)
+               + np.bincount(away[diff < 0], minlength=n))
+        lost = (np.bincount(home[diff < 0], minlength=n)
+                + np.bincount(away[diff > 0], minlength=n))
+        drawn = (np.bincount(home[diff == 0], minlength=n)
+                 + np.bincount(away[diff == 0], minlength=n))
+        pts_for = (np.bincount(home, self.home_pts[idx], minlength=n)
+                   + np.bincount(away, self.away_pts[idx], minlength=n))
+        pts_against = (np.bincount(home, self.away_pts[idx], minlength=n)
+                       + np.bincount(away, self.home_pts[idx], minlength=n))
+        return pd.DataFrame({
+            'team': self.teams,
+            'played': won + drawn + lost,
+            'won': won,
+            'drawn': drawn,
+            'lost': lost,
+            'points_for': pts_for.astype(np.int64),
+            'points_against': pts_against.astype(np.int64),
+        })
+
+    def to_frame(self, idx):
+        """The matches at rows `idx` as a DataFrame."""
+        teams = np.array(self.teams, dtype=object)
+        grounds = np.array(self.grounds, dtype=object)
+        return pd.DataFrame({
+            'date': self.dates[idx],
+            'date_precision': self.date_precision[idx],
+            'home': teams[self.home[idx]],
+            'home_pts': self.home_pts[idx],
+            'away_pts': self.away_pts[idx],
+            'away': teams[self.away[idx]],
+            'ground': grounds[self.ground[idx]],
+            'series': self.series[idx],
+        })
@@ -0,0 +1,345 @@
+import csv
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+from collections import Counter, deque
+
+
+log = logging.getLogger('Match Timeline')
+ch = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s | %(name)s | %(levelname)7s | %(message)s",
+    "%Y-%m-%d %H:%M:%S"
+)
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+# Playing periods are L1, L2 (and L3, L4... in extra time); the others
+# (U, LHT, LFT) are breaks in play
+PLAYING_PHASE = re.compile(r'^L(\d+)$')
+FULL_TIME = 'LFT'
+# Events whose x_pos/y_pos are not a position on the pitch
+NON_POSITIONAL = {'Teams Out', 'MS'}
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=(
+            'Stream a match timeline CSV, keeping live aggregates and '
+            'emitting snapshots'
+        )
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    parser.add_argument(
+        'source', type=str,
+        help='Timeline CSV to read, or tcp://host:port to read from a socket'
+    )
+    parser.add_argument(
+        '-f', '--follow', action='store_true',
+        help='Keep reading as the file grows, until full time'
+    )
+    parser.add_argument(
+        '--poll', type=float, default=0.5,
+        help='Seconds between checks for new lines when following'
+    )
+    parser.add_argument(
+        '-w', '--window', type=float, default=10,
+        help='Length in minutes of the rolling points window'
+    )
+    parser.add_argument(
+        '--teams', type=int, nargs=2, default=None,
+        help='Team ids of the score0 and score1 teams'
+    )
+    parser.add_argument(
+        '--match-data', type=str, default=None,
+        help='Match data JSON to read the team ids from'
+    )
+    parser.add_argument(
+        '--every', type=int, default=0,
+        help='Emit a snapshot every N events as well as on each score'
+    )
+    parser.add_argument(
+        '-o', '--out', type=str, default=None,
+        help='File to append NDJSON snapshots to, defaults to stdout'
+    )
+    parser.add_argument(
+        '--latest', type=str, default=None,
+        help='File to atomically replace with the latest snapshot'
+    )
+    return parser
+
+
+def _float(value):
+    return float(value) if value not in ('', None) else None
+
+
+def _int(value):
+    return int(float(value)) if value not in ('', None) else None
+
+
+class TimelineAggregates:
+    """
+    Incremental aggregates over a stream of timeline events.
+
+    Every `update` is O(1) (amortised for the rolling window). Field
+    positions are in the direction the score0 team attacks in the first
+    half, where x_pos runs from 0 to 100; the direction swaps each period.
+
+    - score: latest score0/score1
+    - window_points: points per team in the last `window` seconds of play
+    - possession: seconds of play per team, attributing the time between
+      two events to the team of the earlier one
+    - territory: seconds of play with the ball in each team's attacking
+      half, and the mean field position of each team's events
+    - phases: points, events and possession per team in each period
+
+    Without `team_ids` the team order is learnt from the first score and
+    events before it are not attributed to either team.
+    """
+
+    def __init__(self, team_ids=None, window=600):
+        self.team_ids = list(team_ids) if team_ids else None
+        self.window = window
+        self.n_events = 0
+        self.events = Counter()
+        self.phase = None
+        self.match_time = 0
+        self.score = [0, 0]
+        self.points = [0, 0]
+        self._window_events = deque()
+        self.window_points = [0, 0]
+        self.possession = [0.0, 0.0]
+        self.territory = [0.0, 0.0]
+        self._position_sum = [0.0, 0.0]
+        self._position_n = [0, 0]
+        self.phases = {}
+        self._last = None
+        self._unassigned = set()
+
+    def _team(self, team_id, row_score):
+        """Index (0 or 1) of `team_id`, learning the order if needed."""
+        if team_id is None:
+            return None
+        if self.team_ids is None:
+            # Learn the order from the first score: the scoring team's
+            # column is the one that moved
+            if row_score != self.score:
+                scorer = 0 if row_score[0] != self.score[0] else 1
+                other = (self._unassigned - {team_id}) or {None}
+                self.team_ids = [None, None]
+                self.team_ids[scorer] = team_id
+                self.team_ids[1 - scorer] = other.pop()
+                log.info('Learnt team order %s from the score', self.team_ids)
+            else:
+                self._unassigned.add(team_id)
+                return None
+        if None in self.team_ids and team_id not in self.team_ids:
+            self.team_ids[self.team_ids.index(None)] = team_id
+        return self.team_ids.index(team_id) if team_id in self.team_ids else None
+
+    def _phase_stats(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = {
+                'events': 0,
+                'points': [0, 0],
+                'possession': [0.0, 0.0],
+                'territory': [0.0, 0.0],
+            }
+        return self.phases[phase]
+
+    def update(self, row):
+        """Add one timeline event (a dict of CSV strings) to the aggregates."""
+        phase = row['phase']
+        match_time = _int(row['match_time']) or 0
+        points = _int(row.get('points')) or 0
+        row_score = [_int(row['score0']) or 0, _int(row['score1']) or 0]
+        team = self._team(_int(row.get('team_id')), row_score)
+        period = PLAYING_PHASE.match(phase)
+
+        self.n_events += 1
+        self.events[row['event']] += 1
+        stats = self._phase_stats(phase)
+        stats['events'] += 1
+
+        # Time since the previous event in the same period goes to the
+        # team that had the ball and to the half the ball was in
+        if period and self._last is not None and self._last['phase'] == phase:
+            elapsed = max(0, match_time - self._last['match_time'])
+            if self._last['team'] is not None:
+                self.possession[self._last['team']] += elapsed
+                stats['possession'][self._last['team']] += elapsed
+            if self._last['x'] is not None:
+                in_half = 0 if self._last['x'] > 50 else 1
+                self.territory[in_half] += elapsed
+                stats['territory'][in_half] += elapsed
+
+        x = _float(row.get('x_pos'))
+        if period and x is not None and row['event'] not in NON_POSITIONAL:
+            if int(period.group(1)) % 2 == 0:
+                x = 100 - x
+            if team is not None:
+                # Field position from the team's own point of view
+                self._position_sum[team] += x if team == 0 else 100 - x
+                self._position_n[team] += 1
+        else:
+            x = None
+
+        if points and team is not None:
+            self.points[team] += points
+            stats['points'][team] += points
+            self._window_events.append((match_time, team, points))
+            self.window_points[team] += points
+        self._expire(match_time)
+
+        self.score = row_score
+        self.phase = phase
+        self.match_time = match_time
+        self._last = {
+            'phase': phase, 'match_time': match_time,
+            'team': team if period else None, 'x': x,
+        }
+        return bool(points)
+
+    def _expire(self, match_time):
+        while (self._window_events
+               and self._window_events[0][0] <= match_time - self.window):
+            _, team, points = self._window_events.popleft()
+            self.window_points[team] -= points
+
+    def snapshot(self):
+        """The current aggregates as a JSON serialisable dict."""
+        def shares(values):
+            total = sum(values)
+            return [round(v / total, 4) if total else None for v in values]
+
+        return {
+            'events': self.n_events,
+            'phase': self.phase,
+            'match_time': self.match_time,
+            'teams': self.team_ids,
+            'score': list(self.score),
+            'points': list(self.points),
+            'window_minutes': self.window / 60,
+            'window_points': list(self.window_points),
+            'possession_secs': list(self.possession),
+            'possession': shares(self.possession),
+            'territory_secs': list(self.territory),
+            'territory': shares(self.territory),
+            'mean_field_position': [
+                round(s / n, 2) if n else None
+                for s, n in zip(self._position_sum, self._position_n)
+            ],
+            'phases': {
+                phase: dict(
+                    stats,
+                    possession=shares(stats['possession']),
+                    territory=shares(stats['territory']),
+                )
+                for phase, stats in self.phases.items()
+            },
+            'event_counts': dict(self.events),
+        }
+
+
+def follow_lines(path, follow=False, poll=0.5, stop=None):
+    """
+    Yield the complete lines of `path`. With `follow`, keep waiting for
+    new lines as the file grows until `stop()` is true.
+    """
+    with open(path, 'r', newline='') as in_f:
+        partial = ''
+        while True:
+            line = in_f.readline()
+            if line:
+                partial += line
+                if partial.endswith('\n'):
+                    yield partial
+                    partial = ''
+                continue
+            if not follow or (stop is not None and stop()):
+                break
+            time.sleep(poll)
+        if partial:
+            yield partial
+
+
+def socket_lines(address):
+    """Yield lines read from a TCP socket at `host:port`."""
+    host, port = address.rsplit(':', 1)
+    with socket.create_connection((host, int(port))) as sock:
+        with sock.makefile('r', newline='') as sock_f:
+            yield from sock_f
+
+
+def team_ids_from_match_data(path):
+    with open(path, 'r') as match_f:
+        return [team['id'] for team in json.load(match_f)['teams']]
+
+
+class SnapshotWriter:
+    """Write snapshots as NDJSON and optionally to a latest-snapshot file."""
+
+    def __init__(self, out=None, latest=None):
+        self.out_f = open(out, 'a') if out else sys.stdout
+        self.latest = latest
+
+    def write(self, snap):
+        text = json.dumps(snap)
+        self.out_f.write(text + '\n')
+        self.out_f.flush()
+        if self.latest:
+            tmp = self.latest + '.tmp'
+            with open(tmp, 'w') as latest_f:
+                latest_f.write(text)
+            os.replace(tmp, self.latest)
+
+    def close(self):
+        if self.out_f is not sys.stdout:
+            self.out_f.close()
+
+
+def process(lines, aggregates, writer, every=0):
+    """Feed CSV `lines` through `aggregates`, writing snapshots as it goes."""
+    start = time.perf_counter()
+    for row in csv.DictReader(lines):
+        scored = aggregates.update(row)
+        if scored or (every and aggregates.n_events % every == 0):
+            writer.write(aggregates.snapshot())
+    writer.write(aggregates.snapshot())
+    elapsed = time.perf_counter() - start
+    log.info(
+        'Processed %d events in %.3fs', aggregates.n_events, elapsed
+    )
+    return aggregates
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    log.setLevel(max([50-args.verbosity*10, 10]))
+    team_ids = args.teams
+    if team_ids is None and args.match_data:
+        team_ids = team_ids_from_match_data(args.match_data)
+    aggregates = TimelineAggregates(team_ids, window=args.window * 60)
+    if args.source.startswith('tcp://'):
+        lines = socket_lines(args.source[len('tcp://'):])
+    else:
+        lines = follow_lines(
+            args.source, follow=args.follow, poll=args.poll,
+            stop=lambda: aggregates.phase == FULL_TIME
+        )
+    writer = SnapshotWriter(args.out, args.latest)
+    try:
+        process(lines, aggregates, writer, every=args.every)
+    except KeyboardInterrupt:
+        writer.write(aggregates.snapshot())
+    finally:
+        writer.close()
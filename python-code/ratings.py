@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+from match_store import MatchStore
+
+
+log = logging.getLogger('Ratings')
+ch = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s | %(name)s | %(levelname)7s | %(message)s",
+    "%Y-%m-%d %H:%M:%S"
+)
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+STATE_VERSION = 1
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Incremental Elo ratings over the test scores CSV')
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    parser.add_argument(
+        '--state', type=str, default=None,
+        help='Ratings state file, defaults to <scorecsv stem>.ratings.npz'
+    )
+    subparsers = parser.add_subparsers(title='program', dest='program')
+
+    update = subparsers.add_parser(
+        'update',
+        help='Bring the ratings up to date with the scores CSV'
+    )
+    update.add_argument(
+        'scorecsv', type=str,
+        help='CSV of test scores'
+    )
+    update.add_argument(
+        '-k', type=float, default=32.0,
+        help='Elo K factor'
+    )
+    update.add_argument(
+        '--home-advantage', type=float, default=0.0,
+        help='Rating points added to the home team'
+    )
+    update.add_argument(
+        '--checkpoint-every', type=int, default=256,
+        help='Number of matches between checkpoints of the ratings'
+    )
+
+    asof = subparsers.add_parser(
+        'asof',
+        help='Print every team\'s rating as of a date'
+    )
+    asof.add_argument(
+        'scorecsv', type=str,
+        help='CSV of test scores the state was built from'
+    )
+    asof.add_argument(
+        'date', type=str,
+        help='Date (YYYY-MM-DD) to give the ratings at'
+    )
+    asof.add_argument(
+        '-n', '--top', type=int, default=20,
+        help='Number of teams to print'
+    )
+    return parser
+
+
+def state_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.ratings.npz'
+
+
+class Ratings:
+    """
+    Elo ratings of every team, updated match by match in date order.
+
+    Teams have stable integer ids (in order of first appearance) indexing
+    the `ratings` array. The ratings of both teams after every match are
+    kept, and a copy of the whole ratings array is checkpointed every
+    `checkpoint_every` matches, so a changed or added result is replayed
+    from the last checkpoint before it instead of from the first match.
+    """
+
+    def __init__(self, k=32.0, home_advantage=0.0, initial=1500.0,
+                 checkpoint_every=256):
+        self.k = k
+        self.home_advantage = home_advantage
+        self.initial = initial
+        self.checkpoint_every = checkpoint_every
+        self.teams = []
+        self.team_ids = {}
+        self.ratings = np.zeros(0)
+        # Matches processed so far, in date order
+        self.dates = np.zeros(0, dtype='datetime64[D]')
+        self.home = np.zeros(0, dtype=np.int32)
+        self.away = np.zeros(0, dtype=np.int32)
+        self.home_pts = np.zeros(0, dtype=np.int16)
+        self.away_pts = np.zeros(0, dtype=np.int16)
+        # Ratings of the home and away team after each match
+        self.home_after = np.zeros(0)
+        self.away_after = np.zeros(0)
+        # {match row: ratings before that row}
+        self.checkpoints = {0: np.zeros(0)}
+
+    def _team_codes(self, names):
+        for name in names:
+            if name not in self.team_ids:
+                self.team_ids[name] = len(self.teams)
+                self.teams.append(name)
+        n_teams = len(self.teams)
+        if len(self.ratings) < n_teams:
+            self.ratings = np.append(
+                self.ratings, np.full(n_teams - len(self.ratings), self.initial)
+            )
+        return np.array([self.team_ids[t] for t in names], dtype=np.int32)
+
+    def _first_change(self, dates, home, away, home_pts, away_pts):
+        """Row of the first match that differs from those already processed."""
+        n = min(len(dates), len(self.dates))
+        differs = (
+            (dates[:n] != self.dates[:n])
+            | (home[:n] != self.home[:n]) | (away[:n] != self.away[:n])
+            | (home_pts[:n] != self.home_pts[:n])
+            | (away_pts[:n] != self.away_pts[:n])
+        )
+        changed = np.flatnonzero(differs)
+        if len(changed):
+            return int(changed[0])
+        return n if len(dates) != len(self.dates) else None
+
+    def _restore(self, row):
+        """Rewind to the last checkpoint at or before `row`."""
+        start = max(r for r in self.checkpoints if r <= row)
+        saved = self.checkpoints[start]
+        self.ratings = np.full(len(self.teams), self.initial)
+        self.ratings[:len(saved)] = saved
+        self.checkpoints = {
+            r: v for r, v in self.checkpoints.items() if r <= start
+        }
+        self.home_after = self.home_after[:start]
+        self.away_after = self.away_after[:start]
+        return start
+
+    def update(self, store):
+        """
+        Bring the ratings up to date with the matches in `store`, a
+        `MatchStore`. Returns the number of matches (re)played.
+        """
+        team_map = self._team_codes(store.teams)
+        # Matches without a date can't be placed in order, so aren't rated
+        dated = ~np.isnat(store.dates)
+        if not dated.all():
+            log.info('Skipping %d matches without a date', (~dated).sum())
+        dates = store.dates[dated]
+        home = team_map[store.home[dated]]
+        away = team_map[store.away[dated]]
+        home_pts = store.home_pts[dated]
+        away_pts = store.away_pts[dated]
+        first = self._first_change(dates, home, away, home_pts, away_pts)
+        if first is None:
+            return 0
+        start = self._restore(first)
+        self.dates = dates
+        self.home, self.away = home, away
+        self.home_pts = home_pts
+        self.away_pts = away_pts
+
+        n = len(self.dates)
+        home_after = np.empty(n - start)
+        away_after = np.empty(n - start)
+        ratings = self.ratings
+        diff = np.sign(
+            self.home_pts[start:].astype(np.int64) - self.away_pts[start:]
+        )
+        result = (diff + 1) / 2
+        for i, row in enumerate(range(start, n)):
+            if row and row % self.checkpoint_every == 0:
+                self.checkpoints[row] = ratings.copy()
+            h, a = home[row], away[row]
+            expected = 1.0 / (1.0 + 10 ** (
+                (ratings[a] - ratings[h] - self.home_advantage) / 400.0
+            ))
+            change = self.k * (result[i] - expected)
+            ratings[h] += change
+            ratings[a] -= change
+            home_after[i] = ratings[h]
+            away_after[i] = ratings[a]
+        self.home_after = np.concatenate((self.home_after, home_after))
+        self.away_after = np.concatenate((self.away_after, away_after))
+        return n - start
+
+    def as_of(self, date):
+        """
+        Every team's rating after the last match on or before `date`, as a
+        DataFrame sorted by rating. Teams yet to play are left out.
+        """
+        n = len(self.dates)
+        n_teams = len(self.teams)
+        end = np.searchsorted(self.dates, np.datetime64(date, 'D'), side='right')
+        # Each team's matches, ordered by team then row
+        team = np.concatenate((self.home, self.away)).astype(np.int64)
+        row = np.concatenate((np.arange(n), np.arange(n)))
+        after = np.concatenate((self.home_after, self.away_after))
+        order = np.lexsort((row, team))
+        keys = team[order] * (n + 1) + row[order]
+        # Last match of each team before row `end`
+        teams = np.arange(n_teams)
+        pos = np.searchsorted(keys, teams * (n + 1) + end, side='left') - 1
+        valid = (pos >= 0) & (team[order][np.maximum(pos, 0)] == teams)
+        last = order[pos[valid]]
+        return pd.DataFrame({
+            'team': np.array(self.teams, dtype=object)[teams[valid]],
+            'rating': after[last],
+            'last_match': self.dates[row[last]],
+        }).sort_values('rating', ascending=False, ignore_index=True)
+
+    def save(self, path):
+        rows = sorted(self.checkpoints)
+        width = len(self.teams)
+        checkpoint_ratings = np.full((len(rows), width), np.nan)
+        for i, r in enumerate(rows):
+            checkpoint_ratings[i, :len(self.checkpoints[r])] = self.checkpoints[r]
+        tmp = path + '.tmp.npz'
+        np.savez(
+            tmp,
+            meta=np.array(json.dumps({
+                'version': STATE_VERSION,
+                'k': self.k,
+                'home_advantage': self.home_advantage,
+                'initial': self.initial,
+                'checkpoint_every': self.checkpoint_every,
+                'teams': self.teams,
+            })),
+            ratings=self.ratings,
+            dates=self.dates, home=self.home, away=self.away,
+            home_pts=self.home_pts, away_pts=self.away_pts,
+            home_after=self.home_after, away_after=self.away_after,
+            checkpoint_rows=np.array(rows, dtype=np.int64),
+            checkpoint_ratings=checkpoint_ratings,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            meta = json.loads(str(state['meta']))
+            if meta['version'] != STATE_VERSION:
+                raise ValueError(f'Unsupported ratings state version in {path}')
+            ratings = cls(
+                meta['k'], meta['home_advantage'], meta['initial'],
+                meta['checkpoint_every']
+            )
+            ratings.teams = meta['teams']
+            ratings.team_ids = {t: i for i, t in enumerate(ratings.teams)}
+            for name in ('ratings', 'dates', 'home', 'away', 'home_pts',
+                         'away_pts', 'home_after', 'away_after'):
+                setattr(ratings, name, state[name])
+            ratings.checkpoints = {
+                int(r): v[~np.isnan(v)]
+                for r, v in zip(state['checkpoint_rows'],
+                                state['checkpoint_ratings'])
+            }
+        return ratings
+
+
+def update_ratings(csv_path, state=None, k=32.0, home_advantage=0.0,
+                   checkpoint_every=256):
+    """
+    Update (or build) the ratings state of `csv_path`, replaying only from
+    the checkpoint before the first new or changed match.
+    """
+    state = state or state_path(csv_path)
+    ratings = None
+    if os.path.exists(state):
+        ratings = Ratings.load(state)
+        if (ratings.k, ratings.home_advantage, ratings.checkpoint_every) != (
+                k, home_advantage, checkpoint_every):
+            log.info('Rating parameters changed, rebuilding from scratch')
+            ratings = None
+    if ratings is None:
+        ratings = Ratings(k, home_advantage, checkpoint_every=checkpoint_every)
+    start = time.perf_counter()
+    replayed = ratings.update(MatchStore.from_csv(csv_path))
+    ratings.save(state)
+    print(
+        f'Replayed {replayed} of {len(ratings.dates)} matches '
+        f'in {time.perf_counter() - start:.2f}s'
+    )
+    return ratings
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    log.setLevel(max([50-args.verbosity*10, 10]))
+    if args.program == 'update':
+        update_ratings(
+            args.scorecsv, args.state, k=args.k,
+            home_advantage=args.home_advantage,
+            checkpoint_every=args.checkpoint_every
+        )
+    elif args.program == 'asof':
+        ratings = Ratings.load(args.state or state_path(args.scorecsv))
+        print(ratings.as_of(args.date).head(args.top).to_string())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import importlib
+import os
+import sys
+from argparse import ArgumentParser, SUPPRESS
+
+from instrumentation import add_arguments, instrumented
+
+
+PLOT_CODE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', 'plots', 'first_match', 'code'
+)
+
+# {command: (module, leading arguments for the module's parser, help)}
+# Modules are only imported when their command runs, so each command only
+# pays for the dependencies it uses.
+COMMANDS = {
+    'scrape': (
+        'rugby_stats', [],
+        'Scrape test match results from ESPN scrum'
+    ),
+    'squads': (
+        'wc_squads', [],
+        'Scrape Rugby World Cup squads and statsguru team results'
+    ),
+    'export': (
+        'test_scores', [],
+        'Export the test scores CSV to JSON'
+    ),
+    'makegeo': (
+        'rugby_geojson_tools', ['makegeo'],
+        'Make a custom GeoJSON that only uses Map Units where necessary'
+    ),
+    'add-geo-ids': (
+        'rugby_geojson_tools', ['add-geo-ids'],
+        'Add GeoJSON feature ids to a CSV of team data using a geo_id column'
+    ),
+    'simplify': (
+        'rugby_geojson_tools', ['simplify'],
+        'Simplify and quantize a GeoJSON, optionally as TopoJSON'
+    ),
+    'plot': (
+        'first_match_plot', [],
+        'Plot the first match of every international team by year'
+    ),
+    'serve': (
+        'simple_cors_http', [],
+        'Serve a directory with CORS headers'
+    ),
+}
+
+
+def _add_common_arguments(parser):
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    add_arguments(parser)
+
+
+def get_parser():
+    parser = ArgumentParser(
+        prog='rugby',
+        description=('Rugby data tools. Run rugby COMMAND --help for the '
+                     'options of each command.')
+    )
+    _add_common_arguments(parser)
+    subparsers = parser.add_subparsers(
+        title='command', dest='command', metavar='COMMAND'
+    )
+    subparsers.required = True
+    for name, (_, _, help_text) in COMMANDS.items():
+        # The command's own parser handles the rest of the arguments
+        subparsers.add_parser(
+            name, help=help_text, add_help=False, usage=SUPPRESS
+        )
+    return parser
+
+
+def load_command(name):
+    """Import the module behind command `name`."""
+    if name == 'plot' and PLOT_CODE_DIR not in sys.path:
+        sys.path.insert(0, PLOT_CODE_DIR)
+    return importlib.import_module(COMMANDS[name][0])
+
+
+def main(argv=None):
+    args, rest = get_parser().parse_known_args(argv)
+    # The common options may also come after the command
+    common = ArgumentParser(add_help=False, allow_abbrev=False)
+    _add_common_arguments(common)
+    args, rest = common.parse_known_args(rest, namespace=args)
+
+    _, leading, _ = COMMANDS[args.command]
+    module = load_command(args.command)
+    # Name the command's usage and errors after this script
+    sys.argv[0] = 'rugby'
+    cmd_parser = module.get_parser()
+    if not leading:
+        cmd_parser.prog = f'rugby {args.command}'
+    cmd_args = cmd_parser.parse_args(leading + rest)
+    cmd_args.verbosity = args.verbosity
+    cmd_args.profile = args.profile
+    cmd_args.metrics_json = args.metrics_json
+    with instrumented(cmd_args):
+        module.run(cmd_args)
+
+
+if __name__ == '__main__':
+    main()
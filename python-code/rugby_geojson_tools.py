@@ -1,11 +1,13 @@
 import logging
 import json
 import csv
+import os
+import re
 from copy import deepcopy
 from argparse import ArgumentParser
 
-import pandas as pd
-import numpy as np
+from instrumentation import add_arguments, count, instrumented, timed, timer
+from snapshots import file_sha256, load_csv
 
 
 log = logging.getLogger('GeoJSON Tools')
@@ -71,6 +73,10 @@ def get_parser():
         '-g', '--geocol', type=str, default='geo_id',
         help='Name of column containing team geoid'
     )
+    mk_geo.add_argument(
+        '--stream', action='store_true',
+        help='Stream features through without loading the GeoJSONs into memory'
+    )
 
     add_geos = subparsers.add_parser(
         'add-geo-ids',
@@ -91,9 +97,87 @@ def get_parser():
         '-g', '--geocol', type=str, default='geo_id',
         help='Name of column containing team geoid'
     )
+
+    simplify = subparsers.add_parser(
+        'simplify',
+        help='Simplify and quantize a GeoJSON, optionally as TopoJSON'
+    )
+    simplify.add_argument(
+        'geojson', type=str,
+        help='GeoJSON to simplify'
+    )
+    simplify.add_argument(
+        'outfile', type=str,
+        help='File to write to, suffixed with .z<zoom> for several zooms'
+    )
+    simplify.add_argument(
+        '-z', '--zoom', type=int, nargs='+', default=None,
+        help='Web map zoom level(s) to derive the tolerance from'
+    )
+    simplify.add_argument(
+        '-p', '--pixels', type=float, default=0.5,
+        help='Tolerance in screen pixels at the given zoom levels'
+    )
+    simplify.add_argument(
+        '-t', '--tolerance', type=float, default=0.0,
+        help='Tolerance in degrees, used when no zoom is given'
+    )
+    simplify.add_argument(
+        '-q', '--quantize', type=float, default=1e6,
+        help='Number of quantization steps across each axis of the bounding box'
+    )
+    simplify.add_argument(
+        '--topojson', action='store_true',
+        help='Write TopoJSON with shared, delta-encoded arcs'
+    )
+    add_arguments(parser)
     return parser
 
 
+def iter_features(geojson_path, chunk_size=2**16):
+    """
+    Yield the features of a FeatureCollection one at a time.
+
+    The file is read in chunks and each feature is decoded as soon as it is
+    complete, so memory use is bounded by the largest single feature.
+    """
+    decoder = json.JSONDecoder()
+    with open(geojson_path, 'r') as geoj:
+        buf = ''
+        while True:
+            chunk = geoj.read(chunk_size)
+            buf += chunk
+            start = re.search(r'"features"\s*:\s*\[', buf)
+            if start:
+                buf = buf[start.end():]
+                break
+            if not chunk:
+                raise ValueError(f'No features array in {geojson_path}')
+            buf = buf[-64:]
+
+        pos = 0
+        read_size = chunk_size
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                feature, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                chunk = geoj.read(read_size)
+                if not chunk:
+                    raise
+                buf = buf[pos:] + chunk
+                pos = 0
+                # Grow reads so huge features are not re-decoded many times
+                read_size *= 2
+                continue
+            read_size = chunk_size
+            pos = end
+            yield feature
+
+
 def geo_units_from_sov(team, refs):
     return _geo_units_from_refs(team, refs, 'SOVEREIGNT')
 
@@ -103,15 +187,52 @@ def geo_units_from_geounit(team, refs):
 
 
 def _geo_units_from_refs(team, refs, key):
-    geo_unit = refs[refs[key] == team]
-    return list(geo_unit.GU_A3)
+    return list(refs[key].get(team, ()))
 
 
-def add_geo_ids(args):
-    with open(args.geojson, 'r') as geoj:
-        geojson = json.load(geoj)
+def build_geo_index(features):
+    """Map SOVEREIGNT and GEOUNIT names to the GU_A3 codes of their features."""
+    index = {'SOVEREIGNT': {}, 'GEOUNIT': {}}
+    for f in features:
+        props = f['properties']
+        for key in index:
+            index[key].setdefault(props[key], []).append(props['GU_A3'])
+    return index
 
-    geodf = pd.DataFrame([f['properties'] for f in geojson['features']])
+
+def load_geo_index(geojson_path):
+    """
+    Load the name -> GU_A3 index for a GeoJSON, building it on first use.
+
+    The index is cached next to the GeoJSON, keyed by the GeoJSON's hash,
+    so the (large) GeoJSON is only parsed again when it changes.
+    """
+    index_path = geojson_path + '.index.json'
+    digest = file_sha256(geojson_path)
+    try:
+        with open(index_path, 'r') as idx:
+            cached = json.load(idx)
+        if cached.get('sha256') == digest:
+            log.debug('Using cached geo index %s', index_path)
+            count('geo_index.cache_hits')
+            return cached['index']
+    except (FileNotFoundError, ValueError):
+        pass
+    with open(geojson_path, 'r') as geoj:
+        index = build_geo_index(json.load(geoj)['features'])
+    try:
+        with open(index_path, 'w') as idx:
+            json.dump({'sha256': digest, 'index': index}, idx)
+        log.info('Wrote geo index %s', index_path)
+    except OSError as err:
+        log.warning('Could not cache geo index: %s', err)
+    return index
+
+
+@timed('add-geo-ids')
+def add_geo_ids(args):
+    with timer('geo index'):
+        geoindex = load_geo_index(args.geojson)
 
     with open(args.teamcsv, 'r') as tm_csv:
         reader = csv.DictReader(tm_csv)
@@ -124,9 +245,9 @@ def add_geo_ids(args):
             )
             geounits = set()
             for tm in teams:
-                gus = geo_units_from_sov(tm, geodf)
+                gus = geo_units_from_sov(tm, geoindex)
                 if not gus:
-                    gus = geo_units_from_geounit(tm, geodf)
+                    gus = geo_units_from_geounit(tm, geoindex)
                     excl_from_sov.update(gus)
                 geounits.update(gus)
             new_rows.append({**row, 'geounits': geounits})
@@ -141,25 +262,73 @@ def add_geo_ids(args):
         writer = csv.DictWriter(outcsv, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(new_rows)
+    count('teams.written', len(new_rows))
+
+
+def _exp_geo(args):
+    tmdf = load_csv(args.teamcsv)
+    exp_geo = set()
+    for g in set(tmdf[args.geocol]):
+        exp_geo.update(COUNTRY_GRPS.get(g, [g]))
+    return exp_geo
+
 
+@timed('makegeo')
+def mk_geojson_stream(args):
+    """
+    Same output as `mk_geojson`, but features are streamed from the input
+    GeoJSONs straight to the output so memory use stays flat.
+    """
+    sovs = {f['properties']['SOVEREIGNT'] for f in iter_features(args.sovgeojson)}
+    mu_sovs = {}
+    for f in iter_features(args.mapunitgeojson):
+        mu_sovs.setdefault(f['properties']['GEOUNIT'], f['properties']['SOVEREIGNT'])
 
+    use_mus = set()
+    for g in _exp_geo(args):
+        if g not in sovs:
+            if g not in mu_sovs:
+                log.warning('No Geounit or Sovereignty found for %s', g)
+                continue
+            use_mus.add(mu_sovs[g])
+    log.info(
+        'Sovereignties have dependencies with international teams: %s',
+        ','.join(use_mus)
+    )
+
+    n_feats = 0
+    with open(args.outgeojson, 'w') as outgeo:
+        outgeo.write('{"type": "FeatureCollection", "features": [')
+        for path, keep_mus in ((args.sovgeojson, False), (args.mapunitgeojson, True)):
+            for f in iter_features(path):
+                if (f['properties']['SOVEREIGNT'] in use_mus) != keep_mus:
+                    continue
+                f['id'] = f['properties']['GU_A3']
+                if n_feats:
+                    outgeo.write(', ')
+                json.dump(f, outgeo)
+                n_feats += 1
+        outgeo.write(']}')
+    count('features.written', n_feats)
+    log.info('Wrote %d features to %s', n_feats, args.outgeojson)
+
+
+@timed('makegeo')
 def mk_geojson(args):
-    with open(args.sovgeojson, 'r') as sgeo:
-        sovgeo = json.load(sgeo)
+    import pandas as pd
+
+    with timer('read geojson'):
+        with open(args.sovgeojson, 'r') as sgeo:
+            sovgeo = json.load(sgeo)
 
-    with open(args.mapunitgeojson, 'r') as mgeo:
-        mugeo = json.load(mgeo)
+        with open(args.mapunitgeojson, 'r') as mgeo:
+            mugeo = json.load(mgeo)
 
     sovdf = pd.DataFrame([f['properties'] for f in sovgeo['features']])
     mudf = pd.DataFrame([f['properties'] for f in mugeo['features']])
-    tmdf = pd.read_csv(args.teamcsv)
-
-    exp_geo = set()
-    for g in set(tmdf[args.geocol]):
-        exp_geo.update(COUNTRY_GRPS.get(g, [g]))
 
     use_mus = set()
-    for g in exp_geo:
+    for g in _exp_geo(args):
         if g not in sovdf.SOVEREIGNT.values:
             try:
                 sov = mudf[mudf['GEOUNIT'] == g].SOVEREIGNT.iloc[0]
@@ -189,16 +358,56 @@ def mk_geojson(args):
     new_geo['type'] = 'FeatureCollection'
     new_geo['features'] = new_feats
 
-    with open(args.outgeojson, 'w') as outgeo:
+    with timer('write geojson'), open(args.outgeojson, 'w') as outgeo:
         json.dump(new_geo, outgeo)
+    count('features.written', len(new_feats))
 
 
-if __name__ == '__main__':
-    parser = get_parser()
-    args = parser.parse_args()
+@timed('simplify')
+def simplify_geojson(args):
+    from geo_simplify import simplify_file, zoom_tolerance
+
+    if args.zoom is None:
+        outputs = [(args.tolerance, args.outfile)]
+    elif len(args.zoom) == 1:
+        outputs = [(zoom_tolerance(args.zoom[0], args.pixels), args.outfile)]
+    else:
+        stem, ext = os.path.splitext(args.outfile)
+        outputs = [
+            (zoom_tolerance(z, args.pixels), f'{stem}.z{z}{ext}')
+            for z in args.zoom
+        ]
+    reports = simplify_file(
+        args.geojson, outputs, quantize=args.quantize, topojson=args.topojson
+    )
+    for r in reports:
+        print(
+            f"{r['output']}: tolerance {r['tolerance']:.6g} deg, "
+            f"{r['points_in']} -> {r['points_out']} points, "
+            f"{r['bytes_in']} -> {r['bytes_out']} bytes "
+            f"({100 * (1 - r['bytes_out'] / r['bytes_in']):.1f}% smaller), "
+            f"max error {r['max_error']:.6g} deg "
+            f"(simplification {r['simplify_error']:.6g}, "
+            f"quantization {r['quantization_error']:.6g})"
+        )
+
+
+def run(args):
     log.setLevel(max([50-args.verbosity*10, 10]))
     print(f'Logging at {logging.getLevelName(log.level)} level')
     if args.program == 'makegeo':
-        mk_geojson(args)
+        if args.stream:
+            mk_geojson_stream(args)
+        else:
+            mk_geojson(args)
     elif args.program == 'add-geo-ids':
         add_geo_ids(args)
+    elif args.program == 'simplify':
+        simplify_geojson(args)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumented(args):
+        run(args)
@@ -1,29 +1,98 @@
-from bs4 import BeautifulSoup
-from bs4 import element
-import requests
-import pandas as pd
-import numpy as np
+import json
+import os
+from argparse import ArgumentParser
 from datetime import datetime
 
+from http_cache import ResponseCache, DEFAULT_CACHE_DIR
+from instrumentation import add_arguments, count, instrumented, timed, timer
+
 ROOT_ESPN = 'http://stats.espnscrum.com'
 TEST_RESULT_URL = ROOT_ESPN + '/scrum/rugby/records/team/match_results.html?id={};type=year'
+SCORE_COLUMNS = [
+    'home', 'home_pts', 'away_pts', 'away', 'home_ht_pts', 'away_ht_pts',
+    'series', 'ground', 'date', 'match_link', 'year',
+    'winning_score', 'losing_score'
+]
+MATCH_KEY = ['date', 'home', 'away']
+
+
+def parse_year(y, html):
+    from table_extract import iter_tables, to_frame
+
+    table = next(iter_tables(html, 'engineTable'), None)
+    if table is None:
+        print(f'No records in {y}')
+        return None
+    df = to_frame(table)
+    df['match_link'] = [row[-1].href for row in table.rows]
+    return df
+
+
+def scrape_scores(from_yr=1871, to_yr=datetime.today().year, jobs=1,
+                  rate=None, retries=3, url=TEST_RESULT_URL,
+                  cache_dir=DEFAULT_CACHE_DIR, outcome=None):
+    """
+    Scrape test results for years in `[from_yr, to_yr)`.
+
+    Years are fetched over a single pooled session using up to `jobs`
+    concurrent requests, limited to `rate` requests per second per host.
+    Results are always assembled in year order.
+
+    Pages are cached in `cache_dir` (set to None to disable); a year's page
+    is frozen, and never refetched, once cached after that year ended.
+
+    Pages that still fail after the retries are skipped. If `outcome` is a
+    dict it is filled with each year's outcome: 'results', 'empty' (no
+    results table) or 'failed'.
+    """
+    from fetching import Fetcher
+
+    years = list(range(from_yr, to_yr))
+    frozen_since = {
+        url.format(y): datetime(y + 1, 1, 1).timestamp()
+        for y in years if y < datetime.today().year
+    }
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    with timer('fetch'), Fetcher(
+            jobs=jobs, rate=rate, retries=retries, cache=cache) as fetcher:
+        pages = fetcher.get_many(
+            (url.format(y) for y in years), frozen=frozen_since.get
+        )
+    fetched = []
+    for y, page in zip(years, pages):
+        if page.status_code == 200:
+            fetched.append((y, page.content))
+        else:
+            print(f'Failed to fetch {y}: HTTP {page.status_code}')
+            count('years.failed')
+            if outcome is not None:
+                outcome[y] = 'failed'
+    found = set()
+    scores = build_scores(fetched, found)
+    if outcome is not None:
+        for y, _ in fetched:
+            outcome[y] = 'results' if y in found else 'empty'
+    return scores
 
 
-def scrape_scores(from_yr=1871, to_yr=datetime.today().year):
+@timed('parse')
+def build_scores(pages, found=None):
+    """
+    Parse and clean the results in `(year, html)` pairs of result pages.
+    The years with a results table are added to the set `found`, if given.
+    """
+    import pandas as pd
+
     test_res = []
-    for y in range(from_yr, to_yr):
-        r = requests.get(TEST_RESULT_URL.format(y))
-        soup = BeautifulSoup(r.text, 'html.parser')
-        table = soup.find("table", {"class": "engineTable"})
-        if table is None:
-            print(f'No records in {y}')
-            continue
-        df = pd.read_html(str(table))[0]
-        links = []
-        for l in [tr.find_all('td')[-1].find('a') for tr in table.tbody.find_all('tr')]:
-            links.append(l if l is None else l.get('href'))
-        df['match_link'] = links
-        test_res.append(df)
+    for y, html in pages:
+        df = parse_year(y, html)
+        if df is not None:
+            count('rows.parsed', len(df))
+            test_res.append(df)
+            if found is not None:
+                found.add(y)
+    if not test_res:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
 
     all_res = pd.concat(test_res)
     all_res.columns = [
@@ -42,4 +111,185 @@ def scrape_scores(from_yr=1871, to_yr=datetime.today().year):
     all_res.reset_index(inplace=True)
     all_res.drop(['na', 'match', 'index'], inplace=True, axis=1)
     return all_res
-    #all_res.to_csv('test_scores.csv')
+
+
+def manifest_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.manifest.json'
+
+
+def read_manifest(csv_path):
+    try:
+        with open(manifest_path(csv_path), 'r') as mf:
+            return json.load(mf)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(csv_path, scores, last_complete_year):
+    with open(manifest_path(csv_path), 'w') as mf:
+        json.dump({
+            'last_complete_year': int(last_complete_year),
+            'rows': len(scores),
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }, mf, indent=2)
+
+
+def last_complete_year(outcome, default):
+    """
+    Latest year up to which every year in `outcome` (see `scrape_scores`)
+    was fetched, starting from `default`.
+
+    A failed year stops the run. So does an empty one after the latest year
+    with results: an empty year before it is taken to be a real gap (e.g.
+    no tests during the wars), but a trailing one may be a broken page.
+    """
+    with_results = [y for y, o in outcome.items() if o == 'results']
+    latest = max(with_results, default=None)
+    last = default
+    for y in sorted(outcome):
+        if outcome[y] == 'failed' or (
+                outcome[y] == 'empty' and (latest is None or y > latest)):
+            break
+        last = y
+    return last
+
+
+def _match_keys(df):
+    keys = df[MATCH_KEY].astype(str)
+    return keys['date'] + '|' + keys['home'] + '|' + keys['away']
+
+
+def merge_scores(existing, new):
+    """
+    Merge freshly scraped `new` rows into `existing`, replacing any rows for
+    the same match.
+
+    Matches are identified by `match_link`, or by (date, home, away) when
+    the link is missing on either side, so merging is idempotent.
+    """
+    import pandas as pd
+
+    existing = existing.copy()
+    new = new.copy()
+    for df in (existing, new):
+        if 'match_link' not in df.columns:
+            df['match_link'] = None
+        df['year'] = df['year'].astype(int)
+    new_links = set(new.match_link.dropna())
+    all_keys = set(_match_keys(new))
+    unlinked_keys = set(_match_keys(new[new.match_link.isna()]))
+
+    old_keys = _match_keys(existing)
+    old_linked = existing.match_link.notna()
+    replaced = (
+        (old_linked & existing.match_link.isin(new_links))
+        | (old_linked & old_keys.isin(unlinked_keys))
+        | (~old_linked & old_keys.isin(all_keys))
+    )
+    new_ids = new.match_link.where(new.match_link.notna(), _match_keys(new))
+    new = new[~new_ids.duplicated(keep='last')]
+
+    merged = pd.concat([existing[~replaced], new], ignore_index=True)
+    merged = merged.sort_values('year', kind='stable').reset_index(drop=True)
+    return merged[[c for c in SCORE_COLUMNS if c in merged.columns]]
+
+
+def update_scores(csv_path, to_yr=datetime.today().year, **kwargs):
+    """
+    Incrementally update the scores CSV at `csv_path`.
+
+    Only years after the last complete year are fetched. That year comes
+    from the manifest written by the previous run, or is taken as the
+    year before the latest one in the CSV when there is no manifest.
+    """
+    import pandas as pd
+
+    with timer('read'):
+        existing = pd.read_csv(csv_path, index_col=0)
+    last_complete = read_manifest(csv_path).get('last_complete_year')
+    if last_complete is None:
+        last_complete = int(existing['year'].max()) - 1
+    print(f'Fetching results for {last_complete + 1} to {to_yr}')
+    outcome = {}
+    new = scrape_scores(last_complete + 1, to_yr + 1, outcome=outcome, **kwargs)
+    # The current year is never complete
+    outcome.pop(to_yr, None)
+    complete = last_complete_year(outcome, last_complete)
+    if complete < to_yr - 1:
+        print(f'Results for {complete + 1} are incomplete, they will be '
+              'fetched again by the next update')
+    with timer('merge'):
+        merged = merge_scores(existing, new)
+    with timer('write'):
+        merged.to_csv(csv_path)
+        write_manifest(csv_path, merged, complete)
+    count('rows.added', len(merged) - len(existing))
+    print(f'Added {len(merged) - len(existing)} rows to {csv_path}')
+    return merged
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Scrape test match results from ESPN scrum')
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of years to fetch concurrently'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=None,
+        help='Maximum requests per second to the host'
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    add_arguments(parser)
+    subparsers = parser.add_subparsers(title='program', dest='program')
+
+    full = subparsers.add_parser(
+        'full', help='Scrape all results and write a new CSV'
+    )
+    full.add_argument(
+        'outcsv', type=str,
+        help='CSV to write results to'
+    )
+    full.add_argument(
+        '--from-year', type=int, default=1871,
+        help='First year to scrape'
+    )
+
+    update = subparsers.add_parser(
+        'update', help='Fetch only new seasons and merge them into a CSV'
+    )
+    update.add_argument(
+        'csv', type=str,
+        help='Existing CSV of results to update in place'
+    )
+    return parser
+
+
+def run(args):
+    if args.program == 'full':
+        this_year = datetime.today().year
+        outcome = {}
+        scores = scrape_scores(
+            args.from_year, this_year + 1, jobs=args.jobs, rate=args.rate,
+            outcome=outcome
+        )
+        outcome.pop(this_year, None)
+        with timer('write'):
+            scores.to_csv(args.outcsv)
+            write_manifest(
+                args.outcsv, scores,
+                last_complete_year(outcome, args.from_year - 1)
+            )
+    elif args.program == 'update':
+        update_scores(args.csv, jobs=args.jobs, rate=args.rate)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumented(args):
+        run(args)
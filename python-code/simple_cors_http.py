@@ -1,12 +1,448 @@
 #!/usr/bin/env python3
-from http.server import HTTPServer, SimpleHTTPRequestHandler, test
-import sys
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+from argparse import ArgumentParser
+from functools import lru_cache, partial
+from http import HTTPStatus
+from http.server import HTTPServer, ThreadingHTTPServer, SimpleHTTPRequestHandler, test
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = {'.html', '.js', '.css', '.svg', '.json', '.csv', '.txt', '.map'}
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 1000
+
+# MatchStore of test results answering /api/ requests, loaded at startup
+STORE = None
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _param(query, name, default=None):
+    values = query.get(name)
+    return values[0] if values else default
+
+
+def _int_param(query, name, default):
+    try:
+        return int(_param(query, name, default))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} must be an integer')
+
+
+def _date_param(query, name):
+    import numpy as np
+    value = _param(query, name)
+    if value is None:
+        return None
+    try:
+        return np.datetime64(value, 'D')
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} must be a YYYY-MM-DD date')
+
+
+def _paginate(items, query):
+    page = _int_param(query, 'page', 1)
+    per_page = min(_int_param(query, 'per_page', DEFAULT_PER_PAGE), MAX_PER_PAGE)
+    if page < 1 or per_page < 1:
+        raise ApiError(HTTPStatus.BAD_REQUEST, 'page and per_page must be positive')
+    start = (page - 1) * per_page
+    return {
+        'total': len(items),
+        'page': page,
+        'per_page': per_page,
+        'pages': -(-len(items) // per_page),
+    }, items[start:start + per_page]
+
+
+def _newest_first(idx):
+    """Reverse the date order of `idx`, keeping matches with no date last."""
+    import numpy as np
+    undated = np.isnat(STORE.dates[idx])
+    return np.concatenate([idx[~undated][::-1], idx[undated]])
+
+
+def _missing(value):
+    return value != value  # NaN and NaT
+
+
+def _match_dicts(idx):
+    store = STORE
+    return [{
+        'date': None if _missing(store.dates[i]) else str(store.dates[i]),
+        'date_precision': (
+            None if _missing(store.date_precision[i]) else store.date_precision[i]
+        ),
+        'home': store.teams[store.home[i]],
+        'away': store.teams[store.away[i]],
+        'home_pts': int(store.home_pts[i]),
+        'away_pts': int(store.away_pts[i]),
+        'ground': store.grounds[store.ground[i]],
+        'series': [s.strip() for s in str(store.series[i]).split('/')],
+    } for i in idx]
+
+
+def api_matches(query):
+    """Matches filtered by team, opponent, from, to and ground, newest first."""
+    idx = STORE.matches(
+        team=_param(query, 'team'), opponent=_param(query, 'opponent'),
+        start=_date_param(query, 'from'), end=_date_param(query, 'to'),
+        ground=_param(query, 'ground'),
+    )
+    meta, idx = _paginate(_newest_first(idx), query)
+    return {**meta, 'matches': _match_dicts(idx)}
+
+
+def api_h2h(query):
+    """Record of team against opponent and their matches, newest first."""
+    team = _param(query, 'team')
+    opponent = _param(query, 'opponent')
+    if team is None or opponent is None:
+        raise ApiError(HTTPStatus.BAD_REQUEST, 'team and opponent are required')
+    for name in (team, opponent):
+        if name not in STORE.team_ids:
+            raise ApiError(HTTPStatus.NOT_FOUND, f'Unknown team: {name}')
+    start = _date_param(query, 'from')
+    end = _date_param(query, 'to')
+    idx = STORE.matches(team, opponent, start, end)
+    meta, idx = _paginate(_newest_first(idx), query)
+    return {
+        'team': team,
+        'opponent': opponent,
+        'record': STORE.head_to_head(team, opponent, start, end),
+        **meta,
+        'matches': _match_dicts(idx),
+    }
+
+
+def api_records(query):
+    records = STORE.records(_date_param(query, 'from'), _date_param(query, 'to'))
+    team = _param(query, 'team')
+    if team is not None:
+        records = records[records.team == team]
+    records = records[records.played > 0].sort_values(
+        ['played', 'team'], ascending=[False, True]
+    )
+    meta, records = _paginate(records, query)
+    return {
+        **meta,
+        'records': [
+            {k: (v if isinstance(v, str) else int(v)) for k, v in r.items()}
+            for r in records.to_dict('records')
+        ],
+    }
+
+
+API_ROUTES = {
+    '/api/matches': api_matches,
+    '/api/h2h': api_h2h,
+    '/api/records': api_records,
+}
+
+
+@lru_cache(maxsize=1024)
+def api_response(path, query_string):
+    """Return `(status, JSON body)` for an API request, LRU cached."""
+    route = API_ROUTES.get(path)
+    try:
+        if route is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f'Unknown endpoint: {path}')
+        if STORE is None:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, 'No dataset loaded')
+        status, body = HTTPStatus.OK, route(parse_qs(query_string))
+    except ApiError as err:
+        status, body = err.status, {'error': str(err)}
+    return status, json.dumps(body).encode('utf-8')
+
 
 class CORSRequestHandler (SimpleHTTPRequestHandler):
+    api_max_age = 300
+
     def end_headers (self):
         self.send_header('Access-Control-Allow-Origin', '*')
         SimpleHTTPRequestHandler.end_headers(self)
 
-if __name__ == '__main__':
-    test(CORSRequestHandler, HTTPServer, port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    def send_head(self):
+        url = urlsplit(self.path)
+        if url.path.startswith('/api/'):
+            return self.send_api(url)
+        return super().send_head()
+
+    def send_api(self, url):
+        self._range = None
+        status, body = api_response(url.path.rstrip('/'), url.query)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == HTTPStatus.OK:
+            self.send_header('Cache-Control', f'public, max-age={self.api_max_age}')
+        self.end_headers()
+        return BytesIO(body)
+
+
+class ProductionRequestHandler(CORSRequestHandler):
+    """
+    CORS handler for serving the dashboards from a threaded server.
+
+    Speaks HTTP/1.1 with keep-alive, serves precompressed `.br`/`.gz`
+    sidecars when the client accepts them, sends strong ETags (answering
+    matching conditional requests with 304), supports single byte-range
+    requests and copies file bodies with `os.sendfile`.
+    """
+    protocol_version = 'HTTP/1.1'
+    max_age = 3600
+    index_pages = ('index.html', 'index.htm')
+    sidecars = (('br', '.br'), ('gzip', '.gz'))
+
+    # path -> (mtime_ns, size, etag), so one entry per file served
+    _etags = {}
+    _etags_lock = threading.Lock()
+
+    def _etag(self, path, st):
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._etags_lock:
+            cached = self._etags.get(path)
+        if cached is not None and cached[:2] == stamp:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                digest.update(chunk)
+        etag = f'"{digest.hexdigest()}"'
+        with self._etags_lock:
+            self._etags[path] = stamp + (etag,)
+        return etag
+
+    def _accepted_encodings(self):
+        """{encoding: q-value} from the Accept-Encoding header."""
+        accepted = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            encoding, *params = [p.strip() for p in item.split(';')]
+            if not encoding:
+                continue
+            q = 1.0
+            for param in params:
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            accepted[encoding.lower()] = q
+        return accepted
+
+    def _choose_encoding(self, path):
+        """
+        Return the fresh sidecar with the highest q-value the client
+        accepts, preferring the order of `sidecars` on ties, else `path`.
+        """
+        accepted = self._accepted_encodings()
+        mtime = os.stat(path).st_mtime
+        best_q, best = 0.0, (path, None)
+        for encoding, suffix in self.sidecars:
+            q = accepted.get(encoding, accepted.get('*', 0.0))
+            sidecar = path + suffix
+            if q > best_q and os.path.isfile(sidecar) \
+                    and os.stat(sidecar).st_mtime >= mtime:
+                best_q, best = q, (sidecar, encoding)
+        return best
+
+    def _byte_range(self, size, etag):
+        """Return `(start, end)` of a satisfiable Range header, else None."""
+        spec = self.headers.get('Range')
+        if not spec or not spec.startswith('bytes=') or ',' in spec:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range != etag:
+            return None
+        first, _, last = spec[len('bytes='):].strip().partition('-')
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+                end = size - 1
+        except ValueError:
+            return None
+        if start > end or start >= size:
+            return False
+        return start, end
 
+    def send_head(self):
+        if urlsplit(self.path).path.startswith('/api/'):
+            return super().send_head()
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and urlsplit(self.path).path.endswith('/'):
+            # Serve the index page like any other file
+            for index in self.index_pages:
+                if os.path.isfile(os.path.join(path, index)):
+                    path = os.path.join(path, index)
+                    break
+        if not os.path.isfile(path):
+            # Redirects, directory listings and 404s
+            self._range = None
+            return super().send_head()
+
+        ctype = self.guess_type(path)
+        body_path, encoding = self._choose_encoding(path)
+        st = os.stat(body_path)
+        etag = self._etag(body_path, st)
+
+        inm = self.headers.get('If-None-Match')
+        tags = [t.strip() for t in inm.split(',')] if inm else []
+        if '*' in tags or etag in tags:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'public, max-age={self.max_age}')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return None
+
+        byte_range = self._byte_range(st.st_size, etag)
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{st.st_size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        f = open(body_path, 'rb')
+        if byte_range:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{st.st_size}')
+        else:
+            start, end = 0, st.st_size - 1
+            self.send_response(HTTPStatus.OK)
+        self._range = (start, end - start + 1)
+        self.send_header('Content-Type', ctype)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'public, max-age={self.max_age}')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self._range is None:
+            return super().copyfile(source, outputfile)
+        offset, count = self._range
+        try:
+            outputfile.flush()
+            out_fd = self.connection.fileno()
+            while count > 0:
+                sent = os.sendfile(out_fd, source.fileno(), offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+        except (AttributeError, OSError):
+            # No sendfile on this platform/socket, copy the remainder
+            source.seek(offset)
+            while count > 0:
+                chunk = source.read(min(count, 2**16))
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                count -= len(chunk)
+
+
+def precompress(directory, min_size=1024):
+    """Write `.gz` (and `.br` if brotli is installed) sidecars for text files."""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE \
+                    or os.path.getsize(path) < min_size:
+                continue
+            mtime = os.path.getmtime(path)
+            if not os.path.exists(path + '.gz') or os.path.getmtime(path + '.gz') < mtime:
+                with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', 9) as dst:
+                    shutil.copyfileobj(src, dst)
+                written += 1
+            if brotli and (not os.path.exists(path + '.br')
+                           or os.path.getmtime(path + '.br') < mtime):
+                with open(path, 'rb') as src, open(path + '.br', 'wb') as dst:
+                    dst.write(brotli.compress(src.read()))
+                written += 1
+    print(f'Wrote {written} compressed sidecars under {directory}')
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Serve a directory with CORS headers')
+    )
+    parser.add_argument(
+        'port', type=int, nargs='?', default=8000,
+        help='Port to listen on'
+    )
+    parser.add_argument(
+        '-b', '--bind', type=str, default=None,
+        help='Address to bind to'
+    )
+    parser.add_argument(
+        '-d', '--directory', type=str, default=os.getcwd(),
+        help='Directory to serve'
+    )
+    parser.add_argument(
+        '--production', action='store_true',
+        help='Threaded HTTP/1.1 server with compression, ETags and ranges'
+    )
+    parser.add_argument(
+        '--precompress', action='store_true',
+        help='Write compressed sidecars for text files before serving'
+    )
+    parser.add_argument(
+        '--max-age', type=int, default=3600,
+        help='Cache-Control max-age in production mode'
+    )
+    parser.add_argument(
+        '--scores', type=str, default=None,
+        help='CSV of test scores to answer /api/ requests from'
+    )
+    return parser
+
+
+def run(args):
+    global STORE
+    if args.precompress:
+        precompress(args.directory)
+    if args.scores:
+        from match_store import MatchStore
+        STORE = MatchStore.from_csv(args.scores)
+        print(f'Loaded {len(STORE)} matches from {args.scores}')
+    if args.production:
+        ProductionRequestHandler.max_age = args.max_age
+        handler = partial(ProductionRequestHandler, directory=args.directory)
+        test(handler, ThreadingHTTPServer, protocol='HTTP/1.1',
+             port=args.port, bind=args.bind)
+    else:
+        handler = partial(CORSRequestHandler, directory=args.directory)
+        test(handler, HTTPServer, port=args.port, bind=args.bind)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    run(args)
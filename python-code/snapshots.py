@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from argparse import ArgumentParser
+
+
+log = logging.getLogger('Snapshots')
+ch = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s | %(name)s | %(levelname)7s | %(message)s",
+    "%Y-%m-%d %H:%M:%S"
+)
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+SCHEMA_VERSION = 1
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Build typed columnar snapshots of CSV datasets')
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    subparsers = parser.add_subparsers(title='program', dest='program')
+
+    build = subparsers.add_parser(
+        'build',
+        help='Build (or rebuild if stale) snapshots for CSVs'
+    )
+    build.add_argument(
+        'csvs', type=str, nargs='+',
+        help='CSVs to snapshot'
+    )
+    build.add_argument(
+        '--force', action='store_true',
+        help='Rebuild even if the snapshot is up to date'
+    )
+    return parser
+
+
+def snapshot_dir(csv_path):
+    return os.path.splitext(csv_path)[0] + '.snapshot'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode(series):
+    """Return `(array, column meta)` for a column of a DataFrame."""
+    import pandas as pd
+
+    if series.dtype.kind in 'iu':
+        values = pd.to_numeric(series, downcast='integer').to_numpy()
+        return values, {'kind': 'values'}
+    if series.dtype.kind in 'fb':
+        return series.to_numpy(), {'kind': 'values'}
+    codes, categories = pd.factorize(series)
+    codes = pd.to_numeric(pd.Series(codes), downcast='integer').to_numpy()
+    return codes, {'kind': 'codes', 'categories': [str(c) for c in categories]}
+
+
+def write_snapshot(csv_path, out_dir=None):
+    """
+    Write a typed columnar snapshot of `csv_path`.
+
+    Each column is saved as its own `.npy` file so it can be memory-mapped
+    on load. String columns are dictionary-encoded with the smallest
+    integer codes that fit and integer columns are downcast.
+    """
+    import numpy as np
+    import pandas as pd
+
+    out_dir = out_dir or snapshot_dir(csv_path)
+    df = pd.read_csv(csv_path)
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns = []
+    for i, name in enumerate(df.columns):
+        values, meta = _encode(df[name])
+        meta['name'] = name
+        meta['file'] = f'{i}.npy'
+        meta['dtype'] = str(values.dtype)
+        np.save(os.path.join(tmp_dir, meta['file']), values)
+        columns.append(meta)
+    stat = os.stat(csv_path)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as meta_f:
+        json.dump({
+            'schema_version': SCHEMA_VERSION,
+            'source': os.path.basename(csv_path),
+            'source_sha256': file_sha256(csv_path),
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+            'rows': len(df),
+            'columns': columns,
+        }, meta_f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    log.info('Wrote snapshot of %s to %s', csv_path, out_dir)
+    return out_dir
+
+
+def _read_meta(snap_dir):
+    try:
+        with open(os.path.join(snap_dir, 'meta.json'), 'r') as meta_f:
+            return json.load(meta_f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_stale(csv_path, meta):
+    if meta is None or meta.get('schema_version') != SCHEMA_VERSION:
+        return True
+    stat = os.stat(csv_path)
+    if (stat.st_size, stat.st_mtime_ns) == (meta['source_size'], meta['source_mtime_ns']):
+        return False
+    return file_sha256(csv_path) != meta['source_sha256']
+
+
+def load_snapshot(snap_dir, meta=None, categorical=False):
+    """
+    Load a snapshot, memory-mapping every column copy-on-write.
+
+    Downcast integer columns are widened back to int64 and string columns
+    are decoded to the same dtype `pd.read_csv` gives them, or kept as
+    `pd.Categorical`s over the stored codes with `categorical`.
+    """
+    import numpy as np
+    import pandas as pd
+
+    meta = meta or _read_meta(snap_dir)
+    data = {}
+    for col in meta['columns']:
+        # Copy-on-write, so the frame can be modified like any other
+        values = np.load(os.path.join(snap_dir, col['file']), mmap_mode='c')
+        if col['kind'] != 'codes':
+            if values.dtype.kind in 'iu':
+                values = values.astype(np.int64)
+            data[col['name']] = values
+        elif categorical:
+            data[col['name']] = pd.Categorical.from_codes(
+                values, categories=col['categories'], validate=False
+            )
+        else:
+            # Code -1 (missing) picks up the NaN appended to the categories
+            categories = np.array(col['categories'] + [np.nan], dtype=object)
+            data[col['name']] = pd.Series(categories[values])
+    return pd.DataFrame(data, copy=False)
+
+
+def _read_csv(csv_path, categorical=False):
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    if categorical:
+        for name in df.columns:
+            if df[name].dtype.kind not in 'iufb':
+                codes, categories = pd.factorize(df[name])
+                df[name] = pd.Categorical.from_codes(codes, categories)
+    return df
+
+
+def load_csv(csv_path, categorical=False):
+    """
+    Drop-in replacement for `pd.read_csv(csv_path)` that goes through a
+    snapshot, rebuilding it first if it is missing or stale. String columns
+    are returned as `pd.Categorical`s with `categorical`.
+
+    If the snapshot can't be written (e.g. a read-only data directory) the
+    CSV is read directly.
+    """
+    snap_dir = snapshot_dir(csv_path)
+    meta = _read_meta(snap_dir)
+    if is_stale(csv_path, meta):
+        try:
+            write_snapshot(csv_path, snap_dir)
+        except OSError as err:
+            log.warning('Could not write a snapshot of %s (%s), reading the CSV',
+                        csv_path, err)
+            return _read_csv(csv_path, categorical=categorical)
+        meta = _read_meta(snap_dir)
+    return load_snapshot(snap_dir, meta, categorical=categorical)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    log.setLevel(max([50-args.verbosity*10, 10]))
+    print(f'Logging at {logging.getLevelName(log.level)} level')
+    if args.program == 'build':
+        for csv_path in args.csvs:
+            if args.force or is_stale(csv_path, _read_meta(snapshot_dir(csv_path))):
+                write_snapshot(csv_path)
+            else:
+                log.info('Snapshot of %s is up to date', csv_path)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_dates, DOB_FORMATS
+
+
+POSITIONS = {
+    'First five-eighth': 'Fly-half',
+    'Half-back': 'Scrum-half',
+    'Loose forward': 'Back row',
+    'Flanker': 'Back row',
+    'Number 8': 'Back row'
+}
+
+PLAYER_KEY = ['year', 'player', 'country']
+
+
+def strip_dob(dob):
+    """Drop the '(aged N)' suffix from Wikipedia dates of birth."""
+    return dob.str.split('(', n=1).str[0].str.strip()
+
+
+def ages(start_date, dob_dt):
+    """Age in whole days at `start_date`, NaN where the birth date is unknown."""
+    return (pd.to_datetime(start_date) - pd.to_datetime(dob_dt)).dt.days
+
+
+def map_positions(position, positions=POSITIONS):
+    """
+    Merge equivalent position names, mapping each distinct name once and
+    expanding the result back out through the category codes.
+    """
+    codes, names = pd.factorize(position)
+    mapped = np.array([positions.get(p, p) for p in names], dtype=object)
+    out = np.append(mapped, np.nan)[codes]
+    return pd.Series(out, index=position.index, name=position.name)
+
+
+def read_club_corrections(path):
+    """{club: country} flag corrections for players of each club."""
+    corrections = pd.read_csv(path, usecols=['club', 'Flag'])
+    return corrections.dropna().set_index('club')['Flag']
+
+
+def read_cap_corrections(path):
+    """Corrected caps, indexed by `PLAYER_KEY`."""
+    corrections = pd.read_csv(path, usecols=PLAYER_KEY + ['caps'])
+    return corrections.set_index(PLAYER_KEY)['caps']
+
+
+def apply_club_corrections(squads, corrections):
+    """
+    Replace flags with the correction for each player's club where there is
+    one, as gh-site/wc-capts.Rmd does with its join on club.
+    """
+    return squads['club'].map(corrections).fillna(squads['flag'])
+
+
+def apply_cap_corrections(squads, corrections):
+    """Replace caps with the corrected value where one is given."""
+    fixed = corrections.reindex(
+        pd.MultiIndex.from_frame(squads[PLAYER_KEY])
+    ).to_numpy()
+    return squads['caps'].where(pd.isna(fixed), fixed)
+
+
+def enrich(squads, club_corrections=None, cap_corrections=None):
+    """
+    Parse dates of birth, add ages at the start of the tournament, merge
+    equivalent positions and apply any club flag and caps corrections.
+    """
+    squads = squads.copy()
+    squads['dob'] = strip_dob(squads['dob'])
+    squads['dob_dt'] = parse_dates(squads['dob'], DOB_FORMATS)['date'].values
+    squads['days_old'] = ages(squads['start_date'], squads['dob_dt'])
+    squads['position'] = map_positions(squads['position'])
+    if club_corrections is not None:
+        squads['flag'] = apply_club_corrections(squads, club_corrections)
+    if cap_corrections is not None:
+        squads['caps'] = apply_cap_corrections(squads, cap_corrections)
+    return squads
@@ -0,0 +1,119 @@
+import re
+from collections import namedtuple
+from io import BytesIO
+
+import pandas as pd
+from lxml import etree
+
+
+# Same whitespace handling as pandas.read_html
+_RE_WHITESPACE = re.compile(r'[\r\n]+|\s{2,}')
+
+Cell = namedtuple('Cell', ['text', 'href', 'flag'])
+Table = namedtuple('Table', ['header', 'rows'])
+
+
+def _hidden(elem):
+    return 'display:none' in elem.get('style', '').replace(' ', '')
+
+
+def _visible_text(elem):
+    """
+    Text of `elem` without `style` elements or elements styled
+    display:none, which pandas.read_html drops (e.g. the hidden ISO date
+    in Wikipedia's birth date template).
+    """
+    parts = [elem.text or '']
+    for child in elem:
+        if (isinstance(child.tag, str) and child.tag != 'style'
+                and not _hidden(child)):
+            parts.append(_visible_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def _cell(td):
+    text = _RE_WHITESPACE.sub(' ', _visible_text(td).strip())
+    link = td.find('.//a')
+    href = link.get('href') if link is not None else None
+    flag = None
+    for span in td.iterfind('.//span'):
+        if 'flagicon' in span.get('class', '').split():
+            flag_link = span.find('.//a')
+            if flag_link is not None:
+                flag = flag_link.get('title')
+            break
+    return Cell(text or None, href, flag)
+
+
+def _table(elem):
+    header = []
+    rows = []
+    for tr in elem.iter('tr'):
+        if _hidden(tr):
+            continue
+        cells = [c for c in tr if c.tag in ('td', 'th') and not _hidden(c)]
+        if not cells:
+            continue
+        if not rows and all(c.tag == 'th' for c in cells):
+            header = [_cell(c).text for c in cells]
+        elif any(c.tag == 'th' for c in cells):
+            continue
+        else:
+            rows.append([_cell(c) for c in cells])
+    return Table(header, rows)
+
+
+def iter_tables(html, css_class=None):
+    """
+    Stream the tables in `html` (str or bytes) in a single parse.
+
+    Only tables whose class attribute contains `css_class` are yielded.
+    Each table has its header texts and rows of `Cell`s holding the cell
+    text plus the first link href and flagicon title found in the cell.
+    Header rows and rows containing `th` cells inside the body are
+    skipped, as `wc_squads.get_flags` always did.
+    """
+    encoding = None
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+        encoding = 'utf-8'
+    for _, elem in etree.iterparse(
+            BytesIO(html), events=('end',), tag='table', html=True,
+            encoding=encoding):
+        if css_class is None or css_class in elem.get('class', '').split():
+            yield _table(elem)
+        elem.clear()
+
+
+def _numeric(values):
+    try:
+        return pd.to_numeric(pd.Series(values, dtype=object))
+    except (ValueError, TypeError):
+        return pd.Series(values, dtype=object)
+
+
+def to_frame(table):
+    """
+    Build a DataFrame of cell texts, naming and converting columns the way
+    pandas.read_html does.
+    """
+    width = max((len(r) for r in table.rows), default=len(table.header))
+    header = list(table.header[:width]) + [None] * (width - len(table.header))
+    columns = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = name if name is not None else f'Unnamed: {i}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        columns.append(name)
+    data = {
+        i: _numeric([r[i].text if i < len(r) else None for r in table.rows])
+        for i in range(width)
+    }
+    df = pd.DataFrame(data)
+    df.columns = columns
+    return df
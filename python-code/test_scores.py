@@ -1,10 +1,53 @@
+#!/usr/bin/env python3
 import datetime as dt
 import csv
+import gzip
 import json
+from argparse import ArgumentParser
+from itertools import islice
 
-with open('test_scores.csv', 'r') as in_f:
-    reader = csv.DictReader(in_f)
-    out = [{
+from date_parsing import parse_dates
+from instrumentation import add_arguments, count, instrumented, timer
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Export the test scores CSV to JSON')
+    )
+    parser.add_argument(
+        'incsv', type=str, nargs='?', default='test_scores.csv',
+        help='CSV of test scores'
+    )
+    parser.add_argument(
+        'outjson', type=str, nargs='?', default='test_scores.json',
+        help='File to write the JSON to'
+    )
+    parser.add_argument(
+        '--ndjson', action='store_true',
+        help='Write one JSON object per line instead of a JSON array'
+    )
+    parser.add_argument(
+        '--gzip', action='store_true',
+        help='Gzip the output'
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    add_arguments(parser)
+    return parser
+
+
+def date_to_json(o):
+    if isinstance(o, (dt.date, dt.datetime)):
+        return o.isoformat()
+
+
+def convert_row(row, date, precision):
+    if date is None:
+        print('Problem with date: {}'.format(row['date']))
+        precision = None
+    return {
         'id': row[''],
         'home': row['home'],
         'away': row['away'],
@@ -13,29 +56,73 @@ with open('test_scores.csv', 'r') as in_f:
         'winning_score': int(row['winning_score']),
         'losing_score': int(row['losing_score']),
         'location': row['ground'],
-        'date': row['date'],
+        'date': date,
         'year': row['year'],
         'series': [s.strip() for s in row['series'].split('/')],
-    } for row in reader]
+        'date_precision': precision,
+    }
+
+
+def iter_rows(path, chunk_size=10000):
+    """
+    Lazily read and convert the rows of the scores CSV at `path`, parsing
+    the dates of each `chunk_size` rows with one `parse_dates` call.
+    """
+    with open(path, 'r') as in_f:
+        reader = csv.DictReader(in_f)
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+            parsed = parse_dates([row['date'] for row in chunk])
+            valid = parsed['precision'].notna()
+            dates = parsed['date'].dt.date.where(valid, None).tolist()
+            precisions = parsed['precision'].astype(object).where(valid, None).tolist()
+            for row, date, precision in zip(chunk, dates, precisions):
+                yield convert_row(row, date, precision)
+
+
+def write_json(rows, out_f, ndjson=False):
+    """
+    Write `rows` to `out_f` one element at a time, as a JSON array or as
+    newline delimited JSON. Returns the number of rows written.
+    """
+    n_rows = 0
+    if not ndjson:
+        out_f.write('[')
+    for row in rows:
+        if ndjson:
+            out_f.write(json.dumps(row, default=date_to_json))
+            out_f.write('\n')
+        else:
+            if n_rows:
+                out_f.write(', ')
+            out_f.write(json.dumps(row, default=date_to_json))
+        n_rows += 1
+    if not ndjson:
+        out_f.write(']')
+    return n_rows
+
+
+def export(incsv, outjson, ndjson=False, compress=False):
+    opener = gzip.open if compress else open
+    with timer('export') as timing, opener(outjson, 'wt') as out_f:
+        n_rows = write_json(iter_rows(incsv), out_f, ndjson=ndjson)
+    count('rows.exported', n_rows)
+    elapsed = timing['secs']
+    print(
+        f'Wrote {n_rows} rows to {outjson} in {elapsed:.2f}s '
+        f'({n_rows / elapsed if elapsed else 0:.0f} rows/s)'
+    )
+    return n_rows
+
+
+def run(args):
+    export(args.incsv, args.outjson, ndjson=args.ndjson, compress=args.gzip)
 
-def date_to_json(o):
-    if isinstance(o, (dt.date, dt.datetime)):
-        return o.isoformat()
 
-for d in out:
-    try:
-        d['date'] = dt.datetime.strptime(d['date'], '%d %b %Y').date()
-    except Exception as err:
-        print(d['id'])
-        try:
-            d['date'] = dt.datetime.strptime(d['date'], '%b %Y').date()
-        except Exception as err:
-            try:
-                d['date'] = dt.datetime.strptime(d['date'], '%Y').date()
-            except Exception as err:
-                print('Problem with date: {}'.format(d['date']))
-
-outj = json.dumps(out, default=date_to_json)
-
-with open('test_scores.json', 'w') as out_j:
-    json.dump(out, out_j, default=date_to_json)
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumented(args):
+        run(args)
@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(CODE_DIR, 'fixtures')
+DATA_DIR = os.path.join(CODE_DIR, '..', 'data')
+
+sys.path.insert(0, CODE_DIR)
+
+YEARS = list(range(2014, 2019))
+
+
+class FixtureServer:
+    """
+    Serve the ESPN results fixture for /results/<year>.html on localhost,
+    with dates and match links in that year. Earlier years answer more
+    slowly, so concurrent fetches finish out of order, and `failures` maps
+    a year to the statuses to answer with before the page.
+    """
+
+    def __init__(self, failures=None):
+        with open(os.path.join(FIXTURES_DIR, 'espn_results_2018.html'), 'rb') as f:
+            self.page = f.read()
+        self.failures = {y: list(s) for y, s in (failures or {}).items()}
+        self.requests = defaultdict(int)
+        self.times = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                year = int(re.search(r'(\d{4})', self.path).group(1))
+                with server._lock:
+                    server.times.append(time.monotonic())
+                    server.requests[year] += 1
+                    failures = server.failures.get(year)
+                    status = failures.pop(0) if failures else 200
+                time.sleep((YEARS[-1] - year) * 0.02)
+                body = server.page.replace(
+                    b' 2018</b>', f' {year}</b>'.encode()
+                ).replace(b'/match/', f'/match/{year}-'.encode())
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/results/{{}}.html'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,41 @@
+from conftest import YEARS, FixtureServer
+from fetching import Fetcher
+from rugby_stats import scrape_scores
+
+
+def test_scores_are_assembled_in_year_order():
+    with FixtureServer() as server:
+        scores = scrape_scores(
+            YEARS[0], YEARS[-1] + 1, jobs=4, url=server.url, cache_dir=None
+        )
+    years = scores['year'].astype(int).tolist()
+    assert sorted(set(years)) == YEARS
+    assert years == sorted(years)
+
+
+def test_retries_with_backoff():
+    failures = {2015: [503, 503], 2017: [429]}
+    with FixtureServer(failures) as server, \
+            Fetcher(jobs=4, retries=3, backoff=0.05) as fetcher:
+        resps = fetcher.get_many(server.url.format(y) for y in YEARS)
+    assert [r.status_code for r in resps] == [200] * len(YEARS)
+    assert dict(server.requests) == {y: 1 + len(failures.get(y, [])) for y in YEARS}
+
+
+def test_gives_up_after_retries():
+    with FixtureServer({2016: [503] * 3}) as server, \
+            Fetcher(retries=2, backoff=0.01) as fetcher:
+        resp = fetcher.get(server.url.format(2016))
+    assert resp.status_code == 503
+    assert server.requests[2016] == 3
+
+
+def test_rate_limit_spaces_requests():
+    rate = 20
+    with FixtureServer({2016: [503]}) as server, \
+            Fetcher(jobs=4, rate=rate, backoff=0.01) as fetcher:
+        fetcher.get_many(server.url.format(y) for y in YEARS)
+    gaps = [b - a for a, b in zip(server.times, server.times[1:])]
+    assert len(server.times) == len(YEARS) + 1
+    # Allow for scheduling jitter between the client and server clocks
+    assert min(gaps) >= 1 / rate - 0.01
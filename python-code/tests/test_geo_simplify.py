@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+
+from geo_simplify import Topology, douglas_peucker, simplify_file
+
+# Two squares sharing a wiggly border along x = 1
+BORDER = [[1, 0], [1, 0.25], [1.01, 0.5], [1, 0.75], [1, 1]]
+
+
+def square(ring):
+    return {
+        'type': 'Feature',
+        'properties': {},
+        'geometry': {'type': 'Polygon', 'coordinates': [ring + ring[:1]]},
+    }
+
+
+def write_squares(tmp_path):
+    left = [[0, 0]] + BORDER + [[0, 1]]
+    right = BORDER[::-1] + [[2, 1], [2, 0]]
+    path = tmp_path / 'squares.geojson'
+    path.write_text(json.dumps({
+        'type': 'FeatureCollection',
+        'features': [square(left), square(right)],
+    }))
+    return str(path)
+
+
+def decode_arcs(topojson):
+    return [np.cumsum(arc, axis=0) for arc in topojson['arcs']]
+
+
+def test_shared_arc_is_written_once(tmp_path):
+    out = str(tmp_path / 'squares.topojson')
+    simplify_file(write_squares(tmp_path), [(0.0, out)], quantize=1e4,
+                  topojson=True)
+    with open(out) as topo_f:
+        topojson = json.load(topo_f)
+
+    left, right = [
+        {i if i >= 0 else ~i for i in g['arcs'][0]}
+        for g in topojson['objects']['features']['geometries']
+    ]
+    shared = left & right
+    assert len(shared) == 1 and len(topojson['arcs']) == 3
+
+    scale = np.array(topojson['transform']['scale'])
+    translate = np.array(topojson['transform']['translate'])
+    border = decode_arcs(topojson)[shared.pop()] * scale + translate
+    border = border[np.lexsort(border.T[::-1])]
+    np.testing.assert_allclose(border, sorted(BORDER), atol=1e-3)
+
+
+def test_simplify_keeps_arc_endpoints(tmp_path):
+    with open(write_squares(tmp_path)) as geo_f:
+        topo = Topology(json.load(geo_f), quantize=1e4).build()
+    arcs, error = topo.simplify(0.1)
+
+    for arc, simple in zip(topo.arcs, arcs):
+        assert (simple[0] == arc[0]).all() and (simple[-1] == arc[-1]).all()
+    # The wiggle on the border is within the tolerance and is dropped
+    shared = next(a for a in arcs if len(a) == 2)
+    assert sorted(topo.dequantize(shared).round(3).tolist()) == [[1, 0], [1, 1]]
+    assert 0.005 < error <= 0.1
+
+
+def test_douglas_peucker():
+    pts = np.array([[0, 0], [1, 0.55], [2, 1], [3, 0.45], [4, 0]], dtype=float)
+    keep, error = douglas_peucker(pts, 0.1)
+    assert keep.tolist() == [True, False, True, False, True]
+    assert 0 < error <= 0.1
@@ -0,0 +1,64 @@
+import time
+from datetime import datetime
+
+import requests
+
+from http_cache import ResponseCache
+
+
+def response(content=b'page'):
+    resp = requests.Response()
+    resp._content = content
+    resp.status_code = 200
+    resp.encoding = 'utf-8'
+    return resp
+
+
+def test_access_times_persist_across_runs(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=8)
+    cache.store('http://a', response())
+    cache.store('http://b', response())
+    cache.lookup('http://a', frozen=True)
+    cache.flush()
+
+    # a was read more recently than b, so b is evicted first
+    cache = ResponseCache(str(tmp_path), max_bytes=8)
+    cache.store('http://c', response())
+    assert cache.lookup('http://a')[0] is not None
+    assert cache.lookup('http://b') == (None, {})
+
+
+def test_revalidated_after_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.revalidated('http://a') is None
+
+
+def test_entry_from_before_freeze_is_revalidated(tmp_path, monkeypatch):
+    clock = {'now': datetime(2018, 6, 1).timestamp()}
+    monkeypatch.setattr(time, 'time', lambda: clock['now'])
+    cache = ResponseCache(str(tmp_path), max_age=3600)
+    resp = response()
+    resp.headers['ETag'] = '"v1"'
+    cache.store('http://2018', resp)
+
+    # Looked up as frozen from the end of 2018, in 2019
+    end_of_2018 = datetime(2019, 1, 1).timestamp()
+    clock['now'] = datetime(2019, 6, 1).timestamp()
+    cached, headers = cache.lookup('http://2018', frozen=end_of_2018)
+    assert cached is None
+    assert headers == {'If-None-Match': '"v1"'}
+
+    # Refreshed after the freeze, so frozen for good
+    assert cache.revalidated('http://2018', frozen=end_of_2018) is not None
+    clock['now'] = datetime(2025, 1, 1).timestamp()
+    assert cache.lookup('http://2018', frozen=end_of_2018)[0] is not None
+
+
+def test_entry_stored_after_freeze_is_served(tmp_path, monkeypatch):
+    clock = {'now': datetime(2019, 2, 1).timestamp()}
+    monkeypatch.setattr(time, 'time', lambda: clock['now'])
+    cache = ResponseCache(str(tmp_path), max_age=3600)
+    end_of_2018 = datetime(2019, 1, 1).timestamp()
+    cache.store('http://2018', response(), frozen=end_of_2018)
+    clock['now'] = datetime(2025, 1, 1).timestamp()
+    assert cache.lookup('http://2018', frozen=end_of_2018)[0] is not None
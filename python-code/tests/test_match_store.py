@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from match_store import MatchStore
+
+
+def make_store():
+    return MatchStore(pd.DataFrame({
+        'home': ['Scotland', 'England', 'Wales'],
+        'away': ['England', 'Scotland', 'England'],
+        'home_pts': [1, 3, 0],
+        'away_pts': [0, 3, 5],
+        'ground': ['Edinburgh', 'London', 'Cardiff'],
+        'series': ['Home Nations'] * 3,
+        'date': ['sometime', '27 Mar 1871', '1883'],
+    }))
+
+
+def test_matches_in_date_order():
+    store = make_store()
+    idx = store.matches(team='England')
+    assert [str(d) for d in store.dates[idx]] == ['1871-03-27', '1883-01-01', 'NaT']
+    assert len(store.matches(team='Ireland')) == 0
+
+
+def test_date_ranges_leave_out_undated_matches():
+    store = make_store()
+    start, end = np.datetime64('1880-01-01'), np.datetime64('1890-01-01')
+    assert len(store.matches(start=start)) == 1
+    assert len(store.matches(end=end)) == 2
+    assert len(store.matches(start=start, end=end)) == 1
+    assert store.records(start=start).set_index('team').played.to_dict() == {
+        'Scotland': 0, 'England': 1, 'Wales': 1
+    }
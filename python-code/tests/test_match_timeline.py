@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+from conftest import DATA_DIR
+from match_timeline import (
+    FULL_TIME, SnapshotWriter, TimelineAggregates, follow_lines, process,
+    team_ids_from_match_data
+)
+
+TIMELINE = os.path.join(DATA_DIR, 'wc_final_timeline.csv')
+MATCH_DATA = os.path.join(DATA_DIR, 'wc_final_match.json')
+
+
+def run_timeline(tmp_path, team_ids, window=600):
+    out = str(tmp_path / 'snapshots.ndjson')
+    writer = SnapshotWriter(out, str(tmp_path / 'latest.json'))
+    aggregates = process(
+        follow_lines(TIMELINE), TimelineAggregates(team_ids, window=window),
+        writer
+    )
+    writer.close()
+    with open(out) as snaps:
+        return aggregates, [json.loads(line) for line in snaps]
+
+
+def test_aggregates_match_final_score(tmp_path):
+    with open(MATCH_DATA) as match_f:
+        final_score = json.load(match_f)['scores']
+    team_ids = team_ids_from_match_data(MATCH_DATA)
+    _, snaps = run_timeline(tmp_path, team_ids, window=100 * 60)
+
+    final = snaps[-1]
+    assert final['phase'] == FULL_TIME
+    assert final['score'] == final['points'] == final_score
+    # The window spans the whole match
+    assert final['window_points'] == final_score
+    assert [
+        sum(p['points'][i] for p in final['phases'].values()) for i in (0, 1)
+    ] == final_score
+    assert sum(final['possession']) == pytest.approx(1, abs=1e-3)
+    assert sum(final['territory']) == pytest.approx(1, abs=1e-3)
+    assert final['events'] == sum(final['event_counts'].values())
+
+    # A snapshot is written for every score, and the score never goes down
+    scores = [s['score'] for s in snaps]
+    assert all(a[0] <= b[0] and a[1] <= b[1] for a, b in zip(scores, scores[1:]))
+    with open(tmp_path / 'latest.json') as latest:
+        assert json.load(latest) == final
+
+
+def test_team_order_learnt_from_score(tmp_path):
+    team_ids = team_ids_from_match_data(MATCH_DATA)
+    aggregates, snaps = run_timeline(tmp_path, None)
+    assert aggregates.team_ids == team_ids
+    assert snaps[-1]['points'] == snaps[-1]['score']
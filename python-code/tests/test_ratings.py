@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+
+from conftest import DATA_DIR
+from ratings import update_ratings
+
+
+def write_scores(tmp_path, edit=None):
+    scores = pd.read_csv(os.path.join(DATA_DIR, 'test_scores.csv'))
+    scores.loc[10, 'date'] = None
+    if edit is not None:
+        edit(scores)
+    path = str(tmp_path / 'test_scores.csv')
+    scores.to_csv(path, index=False)
+    return path, len(scores)
+
+
+def replayed(capsys):
+    out = capsys.readouterr().out
+    return int(out.split()[1])
+
+
+def test_unchanged_csv_replays_nothing(tmp_path, capsys):
+    path, n_rows = write_scores(tmp_path)
+    ratings = update_ratings(path)
+    assert replayed(capsys) == len(ratings.dates) == n_rows - 1
+
+    write_scores(tmp_path)
+    update_ratings(path)
+    assert replayed(capsys) == 0
+
+
+def test_changed_result_replays_from_checkpoint(tmp_path, capsys):
+    path, _ = write_scores(tmp_path)
+    ratings = update_ratings(path)
+    capsys.readouterr()
+
+    def edit(scores):
+        dates = pd.to_datetime(scores['date'], format='%d %b %Y', errors='coerce')
+        scores.loc[dates.idxmax(), 'home_pts'] += 1
+    write_scores(tmp_path, edit)
+    update_ratings(path)
+    assert 0 < replayed(capsys) <= ratings.checkpoint_every
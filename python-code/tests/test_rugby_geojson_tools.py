@@ -0,0 +1,32 @@
+import json
+from argparse import Namespace
+
+from benchmarks import write_geo_inputs
+from rugby_geojson_tools import mk_geojson, mk_geojson_stream
+
+
+def make_args(tmp_path, out_name):
+    paths = write_geo_inputs(str(tmp_path), 6)
+    with open(paths['teamcsv'], 'a') as tm_csv:
+        tm_csv.write('Team X,Atlantis\n')
+    return Namespace(
+        **paths, outgeojson=str(tmp_path / out_name), geocol='geo_id'
+    )
+
+
+def test_stream_matches_in_memory(tmp_path):
+    args = make_args(tmp_path, 'in_memory.geojson')
+    mk_geojson(args)
+    with open(args.outgeojson) as geo_f:
+        expected = json.load(geo_f)
+
+    args.outgeojson = str(tmp_path / 'streamed.geojson')
+    mk_geojson_stream(args)
+    with open(args.outgeojson) as geo_f:
+        assert json.load(geo_f) == expected
+
+    # Countries named by a map unit are split into all their map units
+    ids = [f['id'] for f in expected['features']]
+    assert ids == ['S00000', 'S00002', 'S00004'] + [
+        f'U{i:05d}{j}' for i in (1, 3, 5) for j in range(3)
+    ]
@@ -0,0 +1,67 @@
+import json
+
+import pandas as pd
+
+from conftest import FixtureServer
+from rugby_stats import (
+    last_complete_year, manifest_path, merge_scores, scrape_scores,
+    update_scores
+)
+
+
+def scrape(server, from_yr, to_yr):
+    return scrape_scores(from_yr, to_yr, url=server.url, cache_dir=None)
+
+
+def test_merge_scores_is_idempotent():
+    with FixtureServer() as server:
+        existing = scrape(server, 2014, 2017)
+        new = scrape(server, 2016, 2018)
+    merged = merge_scores(existing, new)
+    assert len(merged) == len(existing) + len(new) // 2
+    pd.testing.assert_frame_equal(merge_scores(merged, new), merged)
+    pd.testing.assert_frame_equal(merge_scores(merged, merged), merged)
+
+
+def test_merge_scores_replaces_changed_results():
+    with FixtureServer() as server:
+        existing = scrape(server, 2016, 2017)
+    new = existing.iloc[:1].copy()
+    new['home_pts'] += 1
+    merged = merge_scores(existing, new)
+    assert len(merged) == len(existing)
+    link = new['match_link'].iloc[0]
+    assert merged.loc[merged.match_link == link, 'home_pts'].tolist() == \
+        new['home_pts'].tolist()
+
+
+def test_last_complete_year():
+    assert last_complete_year({}, 2013) == 2013
+    outcome = {2014: 'results', 2015: 'failed', 2016: 'results'}
+    assert last_complete_year(outcome, 2013) == 2014
+    # A gap between years with results is real, a trailing one is not
+    outcome = {2014: 'results', 2015: 'empty', 2016: 'results', 2017: 'empty'}
+    assert last_complete_year(outcome, 2013) == 2016
+
+
+def test_update_stops_manifest_at_failed_year(tmp_path):
+    path = str(tmp_path / 'scores.csv')
+    with FixtureServer({2016: [503]}) as server:
+        scrape(server, 2014, 2015).to_csv(path)
+        update_scores(
+            path, to_yr=2018, url=server.url, cache_dir=None, retries=0
+        )
+        with open(manifest_path(path)) as mf:
+            assert json.load(mf)['last_complete_year'] == 2015
+        first = pd.read_csv(path, index_col=0)
+        assert 2016 not in set(first['year'])
+
+        # The next update fetches the failed year again
+        update_scores(
+            path, to_yr=2018, url=server.url, cache_dir=None, retries=0
+        )
+        with open(manifest_path(path)) as mf:
+            assert json.load(mf)['last_complete_year'] == 2017
+        assert server.requests[2016] == 2
+    scores = pd.read_csv(path, index_col=0)
+    assert sorted(set(scores['year'])) == [2014, 2015, 2016, 2017, 2018]
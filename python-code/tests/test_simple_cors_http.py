@@ -0,0 +1,160 @@
+import gzip
+import http.client
+import json
+import os
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import simple_cors_http
+from match_store import MatchStore
+from simple_cors_http import ProductionRequestHandler
+
+BODY = b'<html>' + b'rugby ' * 500 + b'</html>'
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / 'page.html').write_bytes(BODY)
+    handler = partial(ProductionRequestHandler, directory=str(tmp_path))
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield tmp_path, httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(port, path, **headers):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', path, headers=headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, body
+
+
+def test_etag_revalidation(server):
+    _, port = server
+    resp, body = get(port, '/page.html')
+    assert resp.status == 200 and body == BODY
+    etag = resp.getheader('ETag')
+
+    resp, body = get(port, '/page.html', **{'If-None-Match': f'"x", {etag}'})
+    assert resp.status == 304 and body == b''
+    assert get(port, '/page.html', **{'If-None-Match': '*'})[0].status == 304
+    assert get(port, '/page.html', **{'If-None-Match': '"x"'})[0].status == 200
+
+
+def test_etag_changes_with_file(server):
+    root, port = server
+    etag = get(port, '/page.html')[0].getheader('ETag')
+    (root / 'page.html').write_bytes(BODY + b'\n')
+    resp, body = get(port, '/page.html', **{'If-None-Match': etag})
+    assert resp.status == 200 and body == BODY + b'\n'
+    assert resp.getheader('ETag') != etag
+    # The old ETag is replaced rather than kept alongside the new one
+    cached = ProductionRequestHandler._etags[str(root / 'page.html')]
+    assert cached[2] == resp.getheader('ETag')
+
+
+def test_byte_ranges(server):
+    _, port = server
+    resp, body = get(port, '/page.html', Range='bytes=6-11')
+    assert resp.status == 206 and body == BODY[6:12]
+    assert resp.getheader('Content-Range') == f'bytes 6-11/{len(BODY)}'
+
+    resp, body = get(port, '/page.html', Range='bytes=-7')
+    assert resp.status == 206 and body == BODY[-7:]
+
+    resp, _ = get(port, '/page.html', Range=f'bytes={len(BODY)}-')
+    assert resp.status == 416
+    assert resp.getheader('Content-Range') == f'bytes */{len(BODY)}'
+
+    # A stale If-Range gets the whole page
+    resp, body = get(port, '/page.html', Range='bytes=0-5', **{'If-Range': '"x"'})
+    assert resp.status == 200 and body == BODY
+
+
+def test_sidecars(server):
+    root, port = server
+    with gzip.open(root / 'page.html.gz', 'wb') as gz:
+        gz.write(BODY)
+
+    resp, body = get(port, '/page.html', **{'Accept-Encoding': 'gzip, br;q=0'})
+    assert resp.getheader('Content-Encoding') == 'gzip'
+    assert gzip.decompress(body) == BODY
+
+    resp, body = get(port, '/page.html', **{'Accept-Encoding': 'gzip;q=0'})
+    assert resp.getheader('Content-Encoding') is None and body == BODY
+
+    # A sidecar older than its source is ignored
+    mtime = os.stat(root / 'page.html').st_mtime
+    os.utime(root / 'page.html.gz', (mtime - 10, mtime - 10))
+    resp, body = get(port, '/page.html', **{'Accept-Encoding': 'gzip'})
+    assert resp.getheader('Content-Encoding') is None and body == BODY
+
+
+@pytest.fixture
+def store(monkeypatch):
+    scores = pd.DataFrame({
+        'home': ['Scotland', 'England', 'Scotland', 'Wales', 'England'],
+        'away': ['England', 'Scotland', 'Wales', 'England', 'Scotland'],
+        'home_pts': [1, 3, 2, 0, 7],
+        'away_pts': [0, 3, 1, 5, 6],
+        'ground': ['Edinburgh', 'London', 'Glasgow', 'Cardiff', 'London'],
+        'series': ['Home Nations / Friendly', 'Home Nations', 'Home Nations',
+                   'Home Nations', 'Friendly'],
+        'date': ['27 Mar 1871', '5 Feb 1872', '1883', 'sometime', 'Mar 1884'],
+    })
+    monkeypatch.setattr(simple_cors_http, 'STORE', MatchStore(scores))
+    simple_cors_http.api_response.cache_clear()
+    yield
+    simple_cors_http.api_response.cache_clear()
+
+
+def api(path, query=''):
+    status, body = simple_cors_http.api_response(path, query)
+    return status, json.loads(body)
+
+
+def test_api_matches_newest_first(store):
+    status, body = api('/api/matches')
+    assert status == 200 and body['total'] == 5
+    # The match with an unknown date comes last, with null date fields
+    assert [m['date'] for m in body['matches']] == [
+        '1884-03-01', '1883-01-01', '1872-02-05', '1871-03-27', None
+    ]
+    assert body['matches'][-1]['date_precision'] is None
+    assert body['matches'][0]['date_precision'] == 'month'
+    assert body['matches'][-2]['series'] == ['Home Nations', 'Friendly']
+
+
+def test_api_pagination(store):
+    _, body = api('/api/matches', 'team=Scotland&per_page=2&page=2')
+    assert {k: body[k] for k in ('total', 'page', 'per_page', 'pages')} == {
+        'total': 4, 'page': 2, 'per_page': 2, 'pages': 2
+    }
+    assert [m['date'] for m in body['matches']] == ['1872-02-05', '1871-03-27']
+
+    _, body = api('/api/matches', 'team=Scotland&per_page=2&page=3')
+    assert body['matches'] == []
+    assert api('/api/matches', 'page=0')[0] == 400
+    assert api('/api/matches', 'per_page=x')[0] == 400
+
+
+def test_api_h2h_and_records(store):
+    status, body = api('/api/h2h', 'team=Scotland&opponent=England&to=1880-01-01')
+    assert status == 200
+    assert body['record'] == {'played': 2, 'won': 1, 'drawn': 1, 'lost': 0,
+                              'points_for': 4, 'points_against': 3}
+    assert [m['home'] for m in body['matches']] == ['England', 'Scotland']
+    assert api('/api/h2h', 'team=Scotland&opponent=Ireland')[0] == 404
+    assert api('/api/h2h', 'team=Scotland')[0] == 400
+
+    _, body = api('/api/records')
+    assert [r['team'] for r in body['records']] == ['England', 'Scotland', 'Wales']
+    assert body['records'][0]['played'] == 4
+    assert api('/api/nowhere')[0] == 404
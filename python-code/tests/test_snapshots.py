@@ -0,0 +1,53 @@
+import os
+import shutil
+
+import pandas as pd
+
+import snapshots
+from conftest import DATA_DIR
+
+
+def copy_scores(tmp_path):
+    csv_path = str(tmp_path / 'test_scores.csv')
+    shutil.copy(os.path.join(DATA_DIR, 'test_scores.csv'), csv_path)
+    return csv_path
+
+
+def test_load_csv_matches_read_csv(tmp_path):
+    csv_path = copy_scores(tmp_path)
+    expected = pd.read_csv(csv_path)
+    pd.testing.assert_frame_equal(snapshots.load_csv(csv_path), expected)
+    assert os.path.isdir(snapshots.snapshot_dir(csv_path))
+    # Served from the snapshot the second time
+    pd.testing.assert_frame_equal(snapshots.load_csv(csv_path), expected)
+
+
+def test_loaded_frame_is_writable(tmp_path):
+    csv_path = str(tmp_path / 'grounds.csv')
+    pd.DataFrame({
+        'ground': ['Twickenham', 'Eden Park'],
+        'lat': [51.456, -36.875],
+        'caps': [10, 20],
+    }).to_csv(csv_path, index=False)
+    snapshots.load_csv(csv_path)
+    df = snapshots.load_csv(csv_path)
+    df.loc[0, 'lat'] = 0.5
+    df.loc[1, 'caps'] = 99
+    assert df.loc[0, 'lat'] == 0.5 and df.loc[1, 'caps'] == 99
+    # The snapshot on disk is left alone
+    pd.testing.assert_frame_equal(snapshots.load_csv(csv_path), pd.read_csv(csv_path))
+
+
+def test_unwritable_snapshot_falls_back_to_csv(tmp_path, monkeypatch):
+    csv_path = copy_scores(tmp_path)
+
+    def read_only(*args):
+        raise PermissionError('Read-only file system')
+
+    monkeypatch.setattr(snapshots, 'write_snapshot', read_only)
+    pd.testing.assert_frame_equal(snapshots.load_csv(csv_path), pd.read_csv(csv_path))
+
+    df = snapshots.load_csv(csv_path, categorical=True)
+    assert isinstance(df['home'].dtype, pd.CategoricalDtype)
+    assert list(df['home'].astype(str)) == list(pd.read_csv(csv_path)['home'])
+    assert not os.path.exists(snapshots.snapshot_dir(csv_path))
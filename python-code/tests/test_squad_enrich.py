@@ -0,0 +1,20 @@
+import os
+
+import pandas as pd
+
+from conftest import DATA_DIR
+from squad_enrich import apply_club_corrections, read_club_corrections
+
+
+def test_club_corrections_match_rmd_join():
+    squads = pd.read_csv(os.path.join(DATA_DIR, 'wc_squads_updated.csv'))
+    path = os.path.join(DATA_DIR, 'club_corrections.csv')
+    # gh-site/wc-capts.Rmd: sqds[club_crrct, flag:=i.Flag, on=c('club')]
+    expected = squads['flag'].copy()
+    corrections = pd.read_csv(path)
+    for club, flag in zip(corrections['club'], corrections['Flag']):
+        expected[squads['club'] == club] = flag
+
+    flags = apply_club_corrections(squads, read_club_corrections(path))
+    pd.testing.assert_series_equal(flags, expected, check_names=False)
+    assert set(flags[squads['club'] == 'Champagnat']) == {'Argentina'}
@@ -0,0 +1,32 @@
+import os
+from io import StringIO
+
+import pandas as pd
+
+from conftest import FIXTURES_DIR
+from table_extract import iter_tables, to_frame
+from squad_enrich import strip_dob
+
+
+def read_wiki_fixture():
+    path = os.path.join(FIXTURES_DIR, 'wiki_squads_2019.html')
+    with open(path, 'r', encoding='utf-8') as page:
+        return page.read()
+
+
+def test_to_frame_matches_read_html():
+    html = read_wiki_fixture()
+    expected = pd.read_html(StringIO(html), attrs={'class': 'sortable'})
+    tables = [to_frame(t) for t in iter_tables(html, 'sortable')]
+    assert len(tables) == len(expected)
+    for table, exp in zip(tables, expected):
+        # read_html may return the string dtype, to_frame returns objects
+        exp = exp.astype(object).where(exp.notna(), None)
+        pd.testing.assert_frame_equal(table, exp, check_dtype=False)
+
+
+def test_hidden_birth_date_is_dropped():
+    table = next(iter_tables(read_wiki_fixture(), 'sortable'))
+    dob = table.rows[0][2].text
+    assert dob == '15 August 1982 (aged\xa037)'
+    assert strip_dob(pd.Series([dob])).tolist() == ['15 August 1982']
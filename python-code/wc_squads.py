@@ -1,7 +1,35 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+
+from fetching import Fetcher
+from http_cache import ResponseCache
+from instrumentation import add_arguments, count, instrumented, timer
+from table_extract import iter_tables, to_frame
+from date_parsing import DOB_FORMATS
+import squad_enrich
+
+log = logging.getLogger('WC Squads')
+ch = logging.StreamHandler()
+formatter = logging.Formatter(
+    "%(asctime)s | %(name)s | %(levelname)7s | %(message)s",
+    "%Y-%m-%d %H:%M:%S"
+)
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+SQUADS_URL = 'http://en.wikipedia.org/wiki/{}_Rugby_World_Cup_squads'
+STATSGURU_URL = (
+    "http://stats.espnscrum.com/statsguru/rugby/stats/index.html"
+    "?class=1;page={};spanmin1=1+Jan+1983;spanval1=span;template=results;type=team;view=year"
+)
 
 rwc_dates = {
     1987: '22 May 1987',
@@ -208,113 +236,20 @@ team_choices = {
     ]
 }
 
-squad_dfs = {}
 rwc_years = set(range(1987, 2020, 4))
 
-def get_flags(html_table):
-    flags = []
-    for row in html_table.find('tbody').find_all('tr'):
-        heads = row.find_all('th')
-        if heads:
-            print('Found header row')
-            continue
-        club_col = row.find_all('td')[-1]
-        flag_span = club_col.find('span', attrs={'class':'flagicon'})
-        flag_id = None
-        if flag_span:
-            flag_id = flag_span.find('a').attrs.get('title')
-        flags.append(flag_id)
-    return flags
-
-for y in rwc_years:
-    try:
-        html = requests.get(f'http://en.wikipedia.org/wiki/{y}_Rugby_World_Cup_squads')
-        tabs = pd.read_html(html.text, attrs={'class': 'sortable'})
-        flags_per_tab = []
-        soup = BeautifulSoup(html.text)
-        tables = soup.find_all("table", { "class" : "sortable" })
-        for t in tables:
-            flags_per_tab.append(get_flags(t))
-        for i, sqd in enumerate(tabs):
-            sqd['flag'] = flags_per_tab[i]
-        squad_dfs[y] = tabs
-        print(f'Successfully fetched HTML for {y}')
-    except Exception as err:
-        print(f'Error fetching HTML for {y}')
-
-for squads in squad_dfs.values():
-    for sq in squads:
-        sq.rename(columns={
-            'Franchise / Province': 'club',
-            'Franchise / province': 'club',
-            'Club/province': 'club',
-            'Date of birth (Age)': 'dob',
-            'Date of birth (age)': 'dob',
-            'Caps': 'caps',
-            'Player': 'player',
-            'Position': 'position',
-        }, inplace=True)
-
-for year, squads in squad_dfs.items():
-    for sq in squads:
-        if 'club' in sq.columns:
-            sq['year'] = year
-            sq['start_date'] = datetime.strptime(rwc_dates[year], "%d %B %Y")
-
-for year, squads in squad_dfs.items():
-    print(year)
-    idx = 0
-    for sq in squads:
-        if 'club' in sq.columns and 'country' not in sq.columns:
-            sq['country'] = team_choices[year][idx]
-            idx += 1
-
-squads_list = []
-for squads in squad_dfs.values():
-    for s in squads:
-        if 'club' in s.columns:
-            squads_list.append(s)
-
-all_squads = pd.concat(squads_list)
-all_squads = all_squads[all_squads.country != 'none']
-
-all_squads['dob'] = all_squads['dob'].str.split('(', expand=True)[0].str.strip()
-all_squads['dob_dt'] = pd.to_datetime(all_squads['dob'], format="%d %B %Y", errors='coerce')
-mask = all_squads.dob_dt.isnull()
-all_squads.loc[mask, 'dob_dt'] = pd.to_datetime(
-    all_squads[mask]['dob'], format='%B %d, %Y', errors='coerce'
-)
-all_squads['days_old'] = (all_squads['start_date'] - all_squads['dob_dt']).apply(lambda x: x.days)
-all_squads.replace(
-    {
-        'First five-eighth': 'Fly-half',
-        'Half-back': 'Scrum-half',
-        'Loose forward': 'Back row',
-        'Flanker': 'Back row',
-        'Number 8': 'Back row'
-    },
-    inplace=True
-)
-
-all_squads.to_csv('wc_squads_processed.csv', index=False)
-
+SQUAD_COLUMNS = {
+    'Franchise / Province': 'club',
+    'Franchise / province': 'club',
+    'Club/province': 'club',
+    'Date of birth (Age)': 'dob',
+    'Date of birth (age)': 'dob',
+    'Caps': 'caps',
+    'Player': 'player',
+    'Position': 'position',
+}
 
-url_tests_86 = (
-    "http://stats.espnscrum.com/statsguru/rugby/stats/index.html"
-    "?class=1;page={};spanmin1=1+Jan+1983;spanval1=span;template=results;type=team;view=year"
-)
-match_tabs = []
-pg_no = 0
-while True:
-    pg_no += 1
-    tab = pd.read_html(url_tests_86.format(pg_no), attrs={'class': 'engineTable'})
-    if len(tab) < 3:
-        break
-    match_tabs.append(tab[1])
-    print(f'Got page {pg_no} of results')
-
-all_matches = pd.concat(match_tabs)
-all_matches.rename(columns={
+MATCH_COLUMNS = {
     'Team': 'team',
     'Mat': 'total_matches',
     'Won': 'won',
@@ -330,6 +265,378 @@ all_matches.rename(columns={
     'Drop': 'drop_goal',
     'Year': 'year',
     'Unnamed: 14': 'to_drop',
-}, inplace=True)
-all_matches.drop('to_drop', axis=1, inplace=True)
-all_matches.to_csv('all_matches_83_19.csv', index=False)
+}
+
+
+def get_flags(table):
+    return [row[-1].flag for row in table.rows]
+
+
+def fetch_squad_pages(fetcher, years=rwc_years, url=SQUADS_URL):
+    """
+    Fetch the squads page of each year in `years` concurrently, returning
+    {year: html}. Years that fail to fetch are reported and left out.
+    """
+    pages = {}
+    with ThreadPoolExecutor(max_workers=fetcher.jobs) as pool:
+        futures = {
+            y: pool.submit(fetcher.get, url.format(y), True) for y in years
+        }
+        for y, fut in futures.items():
+            try:
+                resp = fut.result()
+                resp.raise_for_status()
+                pages[y] = resp.content
+                print(f'Successfully fetched HTML for {y}')
+            except Exception as err:
+                print(f'Error fetching HTML for {y}')
+    return pages
+
+
+def _statsguru_page(fetcher, url):
+    """The results table of a statsguru page, or None on the terminal page."""
+    page = fetcher.get(url)
+    page.raise_for_status()
+    tables = list(iter_tables(page.content, 'engineTable'))
+    if len(tables) < 3:
+        return None
+    return tables[1]
+
+
+def fetch_statsguru(fetcher, url=STATSGURU_URL, window=4):
+    """
+    Fetch the results table of every statsguru page in page order.
+
+    The page count is not known up front, so up to `window` pages ahead of
+    the one being read are fetched speculatively. Each page read schedules
+    the next one; the first terminal page (fewer than 3 tables) stops the
+    scan and cancels the outstanding speculative fetches.
+    """
+    window = max(1, window)
+    tables = []
+    with ThreadPoolExecutor(max_workers=min(fetcher.jobs, window)) as pool:
+        pending = {}
+        next_page = 1
+        for _ in range(window):
+            pending[next_page] = pool.submit(
+                _statsguru_page, fetcher, url.format(next_page)
+            )
+            next_page += 1
+        pg_no = 1
+        while True:
+            table = pending.pop(pg_no).result()
+            if table is None:
+                break
+            tables.append(table)
+            print(f'Got page {pg_no} of results')
+            pending[next_page] = pool.submit(
+                _statsguru_page, fetcher, url.format(next_page)
+            )
+            next_page += 1
+            pg_no += 1
+        for fut in pending.values():
+            fut.cancel()
+    return tables
+
+
+def parse_squads(pages):
+    """Parse the sortable squad tables from each year's page."""
+    squad_dfs = {}
+    for y, html in pages.items():
+        tabs = []
+        for t in iter_tables(html, 'sortable'):
+            sqd = to_frame(t)
+            sqd['flag'] = get_flags(t)
+            count('rows.parsed', len(sqd))
+            tabs.append(sqd)
+        squad_dfs[y] = tabs
+    return squad_dfs
+
+
+def parse_matches(tables):
+    """A DataFrame of each statsguru results table."""
+    tabs = [to_frame(t) for t in tables]
+    count('rows.parsed', sum(len(t) for t in tabs))
+    return tabs
+
+
+def normalise_squads(squad_dfs):
+    """
+    Rename the squad table columns, tag each squad with its year, start
+    date and country and combine them into a single DataFrame of players.
+    """
+    for squads in squad_dfs.values():
+        for sq in squads:
+            sq.rename(columns=SQUAD_COLUMNS, inplace=True)
+
+    for year, squads in squad_dfs.items():
+        for sq in squads:
+            if 'club' in sq.columns:
+                sq['year'] = year
+                sq['start_date'] = datetime.strptime(rwc_dates[year], "%d %B %Y")
+
+    for year, squads in squad_dfs.items():
+        print(year)
+        idx = 0
+        for sq in squads:
+            if 'club' in sq.columns and 'country' not in sq.columns:
+                sq['country'] = team_choices[year][idx]
+                idx += 1
+
+    squads_list = []
+    for squads in squad_dfs.values():
+        for s in squads:
+            if 'club' in s.columns:
+                squads_list.append(s)
+
+    all_squads = pd.concat(squads_list)
+    return all_squads[all_squads.country != 'none']
+
+
+def normalise_matches(match_tabs):
+    all_matches = pd.concat(match_tabs)
+    all_matches.rename(columns=MATCH_COLUMNS, inplace=True)
+    all_matches.drop('to_drop', axis=1, inplace=True)
+    return all_matches
+
+
+def fetch_stage(_, args):
+    fetcher = Fetcher(jobs=args.jobs, rate=args.rate, cache=ResponseCache())
+    with fetcher:
+        squad_pages = fetch_squad_pages(fetcher, rwc_years, args.squads_url)
+        statsguru_pages = fetch_statsguru(
+            fetcher, args.statsguru_url, args.window
+        )
+    print('HTTP cache: {hits} hits, {misses} misses, {revalidated} revalidated'.format(
+        **fetcher.cache.stats
+    ))
+    return {'squads': squad_pages, 'matches': statsguru_pages}
+
+
+def parse_stage(pages, args):
+    return {
+        'squads': parse_squads(pages['squads']),
+        'matches': parse_matches(pages['matches']),
+    }
+
+
+def normalise_stage(parsed, args):
+    return {
+        'squads': normalise_squads(parsed['squads']),
+        'matches': normalise_matches(parsed['matches']),
+    }
+
+
+def enrich_stage(normalised, args):
+    club_corrections = cap_corrections = None
+    if args.club_corrections:
+        club_corrections = squad_enrich.read_club_corrections(args.club_corrections)
+    if args.cap_corrections:
+        cap_corrections = squad_enrich.read_cap_corrections(args.cap_corrections)
+    return {
+        'squads': squad_enrich.enrich(
+            normalised['squads'], club_corrections, cap_corrections
+        ),
+        'matches': normalised['matches'],
+    }
+
+
+def write_stage(enriched, args):
+    enriched['squads'].to_csv(args.squads_csv, index=False)
+    enriched['matches'].to_csv(args.matches_csv, index=False)
+    return {
+        path: _file_sha256(path) for path in (args.squads_csv, args.matches_csv)
+    }
+
+
+# (name, stage function, functions and settings its output depends on)
+STAGES = [
+    ('fetch', fetch_stage, lambda args: [
+        fetch_squad_pages, fetch_statsguru, _statsguru_page,
+        sorted(rwc_years), args.squads_url, args.statsguru_url,
+    ]),
+    ('parse', parse_stage, lambda args: [
+        parse_squads, parse_matches, get_flags,
+    ]),
+    ('normalise', normalise_stage, lambda args: [
+        normalise_squads, normalise_matches,
+        SQUAD_COLUMNS, MATCH_COLUMNS, rwc_dates, team_choices,
+    ]),
+    ('enrich', enrich_stage, lambda args: [
+        squad_enrich, DOB_FORMATS,
+        *(_file_sha256(path)
+          for path in (args.club_corrections, args.cap_corrections) if path),
+    ]),
+    ('write', write_stage, lambda args: [
+        args.squads_csv, args.matches_csv,
+    ]),
+]
+STAGE_NAMES = [name for name, _, _ in STAGES]
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stage_key(name, func, deps, upstream):
+    """Hash of a stage's code, settings and the digest of its input."""
+    parts = [name, inspect.getsource(func), upstream]
+    for dep in deps:
+        is_code = inspect.isfunction(dep) or inspect.ismodule(dep)
+        parts.append(inspect.getsource(dep) if is_code else dep)
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def _checkpoint_paths(checkpoint_dir, name):
+    base = os.path.join(checkpoint_dir, f'{STAGE_NAMES.index(name)}_{name}')
+    return base + '.pkl', base + '.json'
+
+
+def _valid_checkpoint(checkpoint_dir, name, key):
+    """The checkpoint meta of stage `name` if it was built from `key`."""
+    data_path, meta_path = _checkpoint_paths(checkpoint_dir, name)
+    try:
+        with open(meta_path, 'r') as meta_f:
+            meta = json.load(meta_f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('key') != key or not os.path.exists(data_path):
+        return None
+    for path, digest in meta.get('outputs', {}).items():
+        if not os.path.exists(path) or _file_sha256(path) != digest:
+            return None
+    return meta
+
+
+def _write_checkpoint(checkpoint_dir, name, key, data):
+    data_path, meta_path = _checkpoint_paths(checkpoint_dir, name)
+    pd.to_pickle(data, data_path + '.tmp')
+    os.replace(data_path + '.tmp', data_path)
+    meta = {'stage': name, 'key': key, 'digest': _file_sha256(data_path)}
+    if name == 'write':
+        meta['outputs'] = data
+    with open(meta_path + '.tmp', 'w') as meta_f:
+        json.dump(meta, meta_f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return meta
+
+
+def run_pipeline(args):
+    """
+    Run the fetch -> parse -> normalise -> enrich -> write stages.
+
+    Every stage writes a checkpoint keyed on its code, settings and the
+    digest of the previous stage's checkpoint. Stages whose key is
+    unchanged are skipped and the first stage that needs to run resumes
+    from the last valid checkpoint, so editing e.g. the normalisation
+    rules does not refetch anything. `args.rerun` forces a stage and every
+    stage after it to run.
+    """
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    rerun_from = STAGE_NAMES.index(args.rerun) if args.rerun else len(STAGES)
+    data = None
+    upstream = ''
+    timings = []
+    for i, (name, func, deps) in enumerate(STAGES):
+        start = time.perf_counter()
+        key = _stage_key(name, func, deps(args), upstream)
+        meta = None if i >= rerun_from else _valid_checkpoint(
+            args.checkpoint_dir, name, key
+        )
+        if meta is not None:
+            # Loaded lazily, only if a later stage has to run
+            data = None
+            status = 'up to date'
+            count('stages.skipped')
+        else:
+            with timer(name):
+                if data is None and i:
+                    data = pd.read_pickle(_checkpoint_paths(
+                        args.checkpoint_dir, STAGE_NAMES[i - 1]
+                    )[0])
+                data = func(data, args)
+                meta = _write_checkpoint(args.checkpoint_dir, name, key, data)
+            status = 'ran'
+        upstream = meta['digest']
+        elapsed = time.perf_counter() - start
+        timings.append((name, status, elapsed))
+        log.info('Stage %s %s in %.2fs', name, status, elapsed)
+    print(' | '.join(
+        f'{name}: {status} ({elapsed:.2f}s)' for name, status, elapsed in timings
+    ))
+    return timings
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description=('Scrape Rugby World Cup squads and statsguru team results')
+    )
+    parser.add_argument(
+        '--verbosity', '-v', action='count', default=0,
+        help='Set the logging level'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='Number of pages to fetch concurrently'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=None,
+        help='Maximum requests per second to each host'
+    )
+    parser.add_argument(
+        '--window', type=int, default=4,
+        help='Number of statsguru pages to fetch ahead of the one being read'
+    )
+    parser.add_argument(
+        '--squads-url', type=str, default=SQUADS_URL,
+        help='URL template of the squads pages, formatted with the year'
+    )
+    parser.add_argument(
+        '--statsguru-url', type=str, default=STATSGURU_URL,
+        help='URL template of the statsguru pages, formatted with the page'
+    )
+    parser.add_argument(
+        '--squads-csv', type=str, default='wc_squads_processed.csv',
+        help='CSV to write the squads to'
+    )
+    parser.add_argument(
+        '--matches-csv', type=str, default='all_matches_83_19.csv',
+        help='CSV to write the statsguru results to'
+    )
+    parser.add_argument(
+        '--club-corrections', type=str, default=None,
+        help='CSV of club,N,Flag used to override the flag of each club\'s players'
+    )
+    parser.add_argument(
+        '--cap-corrections', type=str, default=None,
+        help='CSV of year,player,country,caps corrections'
+    )
+    parser.add_argument(
+        '--checkpoint-dir', type=str, default='wc_squads.checkpoints',
+        help='Directory for the per-stage checkpoints'
+    )
+    parser.add_argument(
+        '--rerun', choices=STAGE_NAMES, default=None,
+        help='Run this stage and all later ones even if up to date'
+    )
+    add_arguments(parser)
+    return parser
+
+
+def run(args):
+    log.setLevel(max([50-args.verbosity*10, 10]))
+    print(f'Logging at {logging.getLevelName(log.level)} level')
+    run_pipeline(args)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    with instrumented(args):
+        run(args)